@@ -0,0 +1,290 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#======================================================================
+#
+# cnetaio.py - asyncio event loop integration
+#
+# NOTE:
+#  asyncioPython 2Ϊ trollius¼ѭ hostnet/easenet
+# ׽ֿɶʱ add_readerص£Э鶨ʱ call_atȣ
+# Ҫѯconnect/accept/recv/drain Futureasyncioпֱ
+# awaittrollius yield From()ȴ
+#
+#======================================================================
+import sys
+import time
+
+try:
+	import asyncio
+except ImportError:
+	try:
+		import trollius as asyncio
+	except ImportError:
+		asyncio = None
+
+import cnetdew
+import easenet
+
+from cnetdew import RECV_BAD, RECV_BLOCKING
+
+
+#----------------------------------------------------------------------
+# aiodriver - ¼ѭ fileno/deadline/updateĶ
+#----------------------------------------------------------------------
+class aiodriver(object):
+
+	# ʼhostΪѾ initõ hostnet easenet
+	def __init__ (self, host, loop = None):
+		if asyncio is None:
+			raise Exception('asyncio or trollius is required')
+		if loop is None:
+			loop = asyncio.get_event_loop()
+		self.host = host
+		self.loop = loop
+		self.fd = -1
+		self.timer = None
+		self.waiters = []
+
+	# ʼע׽ֶ¼ȶʱ
+	def start (self):
+		self.stop()
+		self.fd = self.host.fileno()
+		if self.fd < 0:
+			return -1
+		self.loop.add_reader(self.fd, self.update)
+		self.update()
+		return 0
+
+	# ֹͣڵȴ Futureȫȡ
+	def stop (self):
+		if self.fd >= 0:
+			self.loop.remove_reader(self.fd)
+			self.fd = -1
+		if self.timer:
+			self.timer.cancel()
+			self.timer = None
+		waiters, self.waiters = self.waiters, []
+		for check, future in waiters:
+			if not future.done():
+				future.cancel()
+		return 0
+
+	# ¶󣬻 Futureٰ deadlineµȶʱ
+	def update (self):
+		self.host.update()
+		self._wakeup()
+		self.schedule()
+		return 0
+
+	# ȶʱһ deadlineʱ update
+	def schedule (self):
+		if self.timer:
+			self.timer.cancel()
+			self.timer = None
+		if self.fd < 0:
+			return -1
+		deadline = self.host.deadline()
+		if deadline is None:
+			return 0
+		delay = max(0.0, deadline - time.time())
+		self.timer = self.loop.call_at(self.loop.time() + delay, self.update)
+		return 0
+
+	# 鵥ȴcheck (Ƿ, )ʱ׳쳣
+	def _check (self, check, future):
+		try:
+			done, result = check()
+		except Exception, e:
+			future.set_exception(e)
+			return True
+		if done:
+			future.set_result(result)
+		return done
+
+	# ѵȴѾɻ߱ȡ FutureֱӶ
+	def _wakeup (self):
+		if not self.waiters:
+			return 0
+		waiters = []
+		for check, future in self.waiters:
+			if future.done():
+				continue
+			if not self._check(check, future):
+				waiters.append((check, future))
+		self.waiters = waiters
+		return 0
+
+	# ȴѾʱص Future
+	def _wait (self, check):
+		future = asyncio.Future(loop = self.loop)
+		if not self._check(check, future):
+			self.waiters.append((check, future))
+		self.schedule()
+		return future
+
+	# һ Future
+	def _error (self, text):
+		future = asyncio.Future(loop = self.loop)
+		future.set_exception(Exception(text))
+		return future
+
+
+#----------------------------------------------------------------------
+# aiohostnet - hostnetĶ˿ڽӿ
+#----------------------------------------------------------------------
+class aiohostnet(aiodriver):
+
+	# ӣFutureĽΪ˿ڱţʧʱΪ쳣
+	def connect (self, uid, passwd, linkdesc):
+		port = self.host.connect(uid, passwd, linkdesc)
+		if port < 0:
+			return self._error('connect error %d'%port)
+		def check():
+			status = self.host.status(port)
+			if status == RECV_BAD:
+				raise Exception('connect failed')
+			return (status == 1), port
+		return self._wait(check)
+
+	# ӣFutureĽΪ (port, uid, passwd, linkdesc)
+	def accept (self):
+		def check():
+			port, uid, passwd, linkdesc = self.host.accept()
+			return (port >= 0), (port, uid, passwd, linkdesc)
+		return self._wait(check)
+
+	# գFutureĽΪ (channel, data)˿ڹرʱΪ쳣
+	def recv (self, port):
+		def check():
+			channel, data = self.host.recv(port)
+			if channel == RECV_BAD:
+				raise Exception('port %d closed'%port)
+			return (channel >= 0), (channel, data)
+		return self._wait(check)
+
+	# ͣ˿ڣµʹݾ췢
+	def send (self, port, channel, data):
+		hr = self.host.send(port, channel, data)
+		self.schedule()
+		return hr
+
+	# ȴɣɿȫԷȷԺ Future
+	def drain (self, port):
+		def check():
+			if not port in self.host.ports:
+				raise Exception('port %d closed'%port)
+			protocol = self.host.ports[port].protocol
+			if len(protocol.sendque) > 0 or len(protocol.snd_buf) > 0:
+				return False, 0
+			return True, 0
+		return self._wait(check)
+
+	# رն˿
+	def close (self, port):
+		hr = self.host.close(port)
+		self.schedule()
+		return hr
+
+
+#----------------------------------------------------------------------
+# aioeasenet - easenetĶԶ˽ӿ
+#----------------------------------------------------------------------
+class aioeasenet(aiodriver):
+
+	# ȡöԶ״̬ԶѾرʱ׳쳣
+	def __status (self, uid, key):
+		status = self.host.status(uid, key)
+		if status < 0 or status == easenet.TYPE_DEAD:
+			raise Exception('peer (%d, %d) closed'%(uid, key))
+		return status
+
+	# ӶԶˣԶ˽Ժ Future
+	def connect (self, uid, key, linkdesc):
+		hr = self.host.newpeer(uid, key, linkdesc)
+		if hr < -1:
+			return self._error('newpeer error %d'%hr)
+		def check():
+			status = self.__status(uid, key)
+			return (status == easenet.TYPE_ESTABLISH), 0
+		return self._wait(check)
+
+	# գFutureĽΪ (channel, data)
+	def recv (self, uid, key):
+		def check():
+			channel, data = self.host.recv(uid, key)
+			if channel == RECV_BAD:
+				raise Exception('peer (%d, %d) closed'%(uid, key))
+			return (channel >= 0), (channel, data)
+		return self._wait(check)
+
+	# ͣԶ˶Уµ
+	def send (self, uid, key, channel, data):
+		hr = self.host.send(uid, key, channel, data)
+		self.schedule()
+		return hr
+
+	# ȴɣԶ˶Ϊҿɿȫȷ
+	def drain (self, uid, key):
+		def check():
+			self.__status(uid, key)
+			peer = self.host.peerlist[(uid, key)]
+			if len(peer.queue) > 0 or peer.type != easenet.TYPE_ESTABLISH:
+				return False, 0
+			ports = self.host.host.ports
+			if not peer.port in ports:
+				return False, 0
+			protocol = ports[peer.port].protocol
+			if len(protocol.sendque) > 0 or len(protocol.snd_buf) > 0:
+				return False, 0
+			return True, 0
+		return self._wait(check)
+
+	# رնԶ
+	def close (self, uid, key):
+		hr = self.host.delpeer(uid, key)
+		self.schedule()
+		return hr
+
+
+#----------------------------------------------------------------------
+# testing case
+#----------------------------------------------------------------------
+if __name__ == '__main__':
+	import cnetudp
+	def test1():
+		From = getattr(asyncio, 'From', lambda x: x)
+		loop = asyncio.get_event_loop()
+		stun = cnetudp.userver()
+		stun.open(0)
+		loop.add_reader(stun.fileno(), stun.update)
+		server = ('127.0.0.1', stun.port)
+		host1 = easenet.easenet()
+		host2 = easenet.easenet()
+		host1.init(20013080, 123, 0, server)
+		host2.init(20013070, 456, 0, server)
+		net1 = aioeasenet(host1, loop)
+		net2 = aioeasenet(host2, loop)
+		net1.start()
+		net2.start()
+		@asyncio.coroutine
+		def echo():
+			while 1:
+				channel, data = yield From(net2.recv(20013080, 123))
+				net2.send(20013080, 123, channel, data)
+		@asyncio.coroutine
+		def client():
+			while host1.login() != 1 or host2.login() != 1:
+				yield From(asyncio.sleep(0.1))
+			net2.connect(20013080, 123, host1.linkdesc())
+			yield From(net1.connect(20013070, 456, host2.linkdesc()))
+			print 'connected', host1.getroute(20013070, 456)
+			asyncio.ensure_future(echo())
+			for i in xrange(10):
+				net1.send(20013070, 456, 0, '%d %f'%(i, time.time()))
+				channel, data = yield From(net1.recv(20013070, 456))
+				record = data.split(' ')
+				print '[RECV] seq=%s rtt=%f'%(record[0], \
+					time.time() - float(record[1]))
+		loop.run_until_complete(client())
+	test1()
+
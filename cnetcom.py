@@ -10,18 +10,27 @@
 # 
 #======================================================================
 import sys
+import os
 import time
 import socket
 import struct
+import hashlib
+import heapq
 import collections
 
 import cnetudp
 
 
 #----------------------------------------------------------------------
-# messages header
+# messages header32ֽڣʽԤ롣 __slots__ÿһ
+# __dict__unmarshalԴ str/bytearray/memoryviewƫƽ
+# Ƭ
 #----------------------------------------------------------------------
+_msghead_struct = struct.Struct('!llllllll')
+
 class msghead(object):
+	__slots__ = ('suid', 'skey', 'duid', 'dkey', 'sport', 'dport', 'cmd', \
+		'conv', 'raw')
 	def __init__ (self, suid = 0, skey = 0, duid = 0, dkey = 0, sport = 0, \
 					dport = 0, cmd = 0, conv = 0):
 		self.suid = suid
@@ -42,23 +51,22 @@ class msghead(object):
 	def __str__ (self):
 		return self.__repr__()
 	def marshal (self):
-		msg = struct.pack('!llllllll', self.suid, self.skey, self.duid, \
+		msg = _msghead_struct.pack(self.suid, self.skey, self.duid, \
 			self.dkey, self.sport, self.dport, self.cmd, self.conv)
 		self.raw = msg
 		return self.raw
-	def unmarshal (self, data):
-		if len(data) != 32:
-			raise Exception('header size is not 32')
-		record = struct.unpack('!llllllll', data)
-		self.suid = record[0]
-		self.skey = record[1]
-		self.duid = record[2]
-		self.dkey = record[3]
-		self.sport = record[4]
-		self.dport = record[5]
-		self.cmd = record[6]
-		self.conv = record[7]
-		self.raw = data
+	#  data offset룬dataԱ 32ֽڳϢ壩
+	# strͷʱ 32ֽ unpack unpack_fromĲ
+	def unmarshal (self, data, offset = 0):
+		if len(data) < offset + 32:
+			raise Exception('header size is less than 32')
+		if offset == 0 and type(data) is str:
+			record = _msghead_struct.unpack(data[:32])
+		else:
+			record = _msghead_struct.unpack_from(data, offset)
+		self.suid, self.skey, self.duid, self.dkey, self.sport, \
+			self.dport, self.cmd, self.conv = record
+		self.raw = ''
 		return self
 
 
@@ -90,6 +98,61 @@ CMD_FACK1	= 0x4031		# close: fin_ack_1
 CMD_FIN2	= 0x4032		# close: fin_2
 CMD_FACK2	= 0x4033		# close: fin_ack_2
 
+_classify_data = struct.pack('!l', CMD_DATA)
+
+# նзࣨ udpnet.shedϢΪ 'data'͸Ӽ
+# ϢΪ 'control'
+def classify(rawdata):
+	if rawdata[24:28] == _classify_data:
+		return 'data'
+	return 'control'
+
+#----------------------------------------------------------------------
+#  punchingͷ HELLO/HACK/TOUCH/TACK msghead.conv
+# PUNCH_VERSIONʾֶ֧Ƹʽϰ汾 convֻжԷ
+# ֲ֧ŷͶϢȻöŷָıϢһ
+# ֽΪ汾ţıϢֿͷʱΪ΢ַΪ
+# ip/port/modeHELLOе linkdescڶԷȷյԺֻ 8ֽժҪ
+#----------------------------------------------------------------------
+PUNCH_VERSION	= 1
+PUNCH_FULL		= 0x01		# HELLO linkdesc
+PUNCH_NEEDFULL	= 0x02		# HACKʶժҪҪ linkdesc
+PUNCH_LIMIT		= 0x10000	# ¼ٸԶ˵ linkdesc
+
+PUNCH_PPS		= 400		# punchingĬÿ෢Ͷٸ0Ϊ
+PUNCH_BURST		= 0.25		# Ͱ൱ڶԤ
+PUNCH_BACKOFF	= 1.5		# ÿԶ hello
+PUNCH_INTERVAL	= 3.0		# ÿԶ hello
+PUNCH_WINDOW	= 16		# 򿪶˿ԤʱԤⴰڣ˿
+
+CACHE_AGE		= 86400		# ·ɻЧڣ룩
+CACHE_LIMIT		= 4096		# ·ɻ¼ٸԶ
+CACHE_SAVE		= 30.0		# ·ɻб仯ʱдһļ
+
+# 汾־ʱipportmodeժҪ linkdescں棩
+_punch_hello = struct.Struct('!BBQ4sHB8s')
+# 汾־ʱaddr1(ipportmode)addr2ժҪ
+_punch_route = struct.Struct('!BBQ4sHB4sHB8s')
+_punch_empty = '\x00' * 8
+
+# linkdescժҪ
+def punch_digest(linkdesc):
+	return hashlib.md5(linkdesc).digest()[:8]
+
+# ַת棺 ipַ ipת
+_punch_ipcache = {}
+
+def _punch_ip(key):
+	if len(_punch_ipcache) >= PUNCH_LIMIT:
+		_punch_ipcache.clear()
+	if len(key) == 4:
+		value = socket.inet_ntoa(key)
+	else:
+		value = socket.inet_aton(key)
+	_punch_ipcache[key] = value
+	_punch_ipcache[value] = key
+	return value
+
 LOG_HELLO	= 0x01
 LOG_HACK	= 0x02
 LOG_TOUCH	= 0x04
@@ -98,6 +161,12 @@ LOG_PUNCHING = (LOG_HELLO | LOG_HACK | LOG_TOUCH | LOG_TACK)
 
 LOG_ROUTE	= 0x10
 
+PATH_PROBE		= 2.0		# ͨ·ȷԺÿͨ·̽
+PATH_CONFIRM	= 3			# Ӧεͨ·ſлȥ
+PATH_DWELL		= 5.0		# л֮ʱ
+PATH_GAIN		= 0.7		# ͬͨ·Ҫڵǰ 70%л
+PATH_REPUNCH	= 5.0		# ǰתʱ helloѰֱ
+
 
 #----------------------------------------------------------------------
 # routing - ·ɹ
@@ -106,6 +175,9 @@ LOG_ROUTE	= 0x10
 # ·ɹڹѡһ̨õͨ·punching
 # еյTACKʱ򣬵routingnewroutepunching֤
 # Ϸһͨ·¼ȥʱʹbestrouteȡ·
+# ͨ·ȷԺ probeʱҪ̽ͨ· hostbaseÿͨ·
+# pingmeasure¼ӦͳƸͨ· rtt붪͵л
+# bestversionһѽӾݴǨơ
 #----------------------------------------------------------------------
 class routing(object):
 
@@ -129,6 +201,14 @@ class routing(object):
 		self.replys = 0
 		self.hello_cnt = 0
 		self.hello_max = 100
+		self.quality = {}		# ͨ·key -> [srtt, , ȴ̽, Ӧ]
+		self.probe_seq = 0
+		self.time_probe = current
+		self.time_switch = current
+		self.version = 0		# bestͨ·ȷԺÿлһμһ
+		self.cached = None		# ֤Ļͨ·(addr1, mode1, addr2, mode2)
+		self.relay = False		# ˫ nat;޷ֱֻת
+		self.predicted = set()	# ԷԤ˿ڷ͹ helloĵַ
 	
 	# Ƚͨ·
 	def cmproute (self, route1, route2):
@@ -157,10 +237,12 @@ class routing(object):
 		self.map[key] = min(self.map.get(key, 30), rtt)
 		if not self.best:
 			self.best = route
-		elif self.cmproute(route, self.best) < 0:
-			self.best = route
+		elif self.state == 0 and self.cmproute(route, self.best) < 0:
+			self.best = route		# ȷԺл __select
 		if (self.state == 0) and (self.best[2] + self.best[4] == 0):
 			self.state = 1
+		elif self.state == 0 and self.relay:	# ֱõȴ
+			self.state = 1
 		self.replys += 1
 		return 0
 
@@ -173,6 +255,97 @@ class routing(object):
 	# 
 	def active (self):
 		self.time_life = self.current + self.life
+
+	# ͨ·̽⣺ͨ·ȷԺÿ PATH_PROBEҪ pingͨ·
+	# [(key, seq)]һ̽⻹ûлӦļΪ
+	def probe (self, current):
+		if self.state != 1 or current < self.time_probe:
+			return []
+		self.time_probe = current + PATH_PROBE
+		result = []
+		for key in self.map:
+			quality = self.quality.get(key)
+			if quality is None:
+				quality = [self.map[key], 0.0, 0, 0]
+				self.quality[key] = quality
+			if quality[2]:
+				quality[1] = quality[1] * 0.75 + 0.25
+				quality[3] = 0
+			self.probe_seq += 1
+			quality[2] = self.probe_seq
+			result.append((key, self.probe_seq))
+		self.__select(current)
+		return result
+
+	# ̽ӦseqΪ probeصţ1ʾ bestл
+	def measure (self, seq, rtt, current):
+		for key, quality in self.quality.iteritems():
+			if quality[2] == seq:
+				quality[0] = quality[0] * 0.875 + rtt * 0.125
+				quality[1] = quality[1] * 0.75
+				quality[2] = 0
+				quality[3] += 1
+				version = self.version
+				self.__select(current)
+				return (version != self.version) and 1 or 0
+		return 0
+
+	# ͨ·֣ԽСԽã rtt
+	def __score (self, quality):
+		return quality[0] * (1.0 + 4.0 * quality[1])
+
+	# ѡͨ·ֻлӦ PATH_CONFIRMεͨ·ǰת
+	# Էֱʱлǰͨ·ʱлõͨ·
+	# Ҫֵڵǰ PATH_GAINҺϴл PATH_DWELL
+	def __select (self, current):
+		if not self.best or current < self.time_switch + PATH_DWELL:
+			return 0
+		now = self.best[1:]
+		relay = self.best[2] + self.best[4]
+		nowq = self.quality.get(now)
+		failing = nowq is not None and nowq[3] == 0 and nowq[1] >= 0.5
+		choice, score = None, None
+		for key, quality in self.quality.iteritems():
+			if key == now or quality[3] < PATH_CONFIRM:
+				continue
+			direct = (key[1] + key[3] == 0)
+			if relay == 0 and not direct and not failing:
+				continue
+			value = self.__score(quality)
+			if score is None or value < score:
+				choice, score = key, value
+		if choice is None:
+			return 0
+		if nowq is not None and not failing:
+			if relay == 0 or choice[1] + choice[3] > 0:
+				if score >= self.__score(nowq) * PATH_GAIN:
+					return 0
+		rtt = self.quality[choice][0]
+		self.best = (rtt, choice[0], choice[1], choice[2], choice[3])
+		self.time_switch = current
+		self.version += 1
+		return 1
+
+	# ͨ·״̬[(srtt, , addr1, mode1, addr2, mode2)]
+	def paths (self):
+		result = []
+		for key, quality in self.quality.iteritems():
+			result.append((quality[0], quality[1]) + key)
+		result.sort()
+		return result
+
+	# һҪ updateʱ䣺δȷ״̬ѡͨ·ʱ
+	def deadline (self):
+		if self.state < 0:
+			return self.current
+		deadline = min(self.time_slap, self.time_life)
+		if self.state == 0 and self.best:
+			for t in (self.time_hello, self.time_best):
+				if t > self.current and t < deadline:
+					deadline = t
+		elif self.state == 1 and self.time_probe < deadline:
+			deadline = self.time_probe
+		return deadline
 	
 	# ״̬01hello2ping-1ùر -2ֹ
 	def update (self, current = None):
@@ -191,12 +364,19 @@ class routing(object):
 			return -2
 		if self.state > 0:
 			self.time_tick = 20
+			if self.best[2] + self.best[4] > 0 and not self.relay:
+				if self.hello_cnt < self.hello_max:		# תУѰֱ
+					self.time_tick = PATH_REPUNCH
 			if current >= self.time_slap:
 				self.time_slap = current + self.time_tick
+				if self.time_tick == PATH_REPUNCH:
+					self.hello_cnt += 1
+					return 1
 				return 2
 			return 0
 		if current >= self.time_slap:
 			self.time_slap = current + self.time_tick
+			self.time_tick = min(self.time_tick * PUNCH_BACKOFF, PUNCH_INTERVAL)
 			self.hello_cnt += 1
 			if self.hello_cnt >= self.hello_max:
 				self.state = -1
@@ -205,7 +385,7 @@ class routing(object):
 		if self.best:
 			if self.best[2] + self.best[4] == 0:
 				type1 = cnetudp.iptype(self.best[1][0])
-				type2 = centudp.iptype(self.best[3][0])
+				type2 = cnetudp.iptype(self.best[3][0])
 				if type1 < 10 and type2 < 10:
 					self.state = 1
 			if current >= self.time_hello:
@@ -233,31 +413,69 @@ class hostbase(object):
 		self.trace = None
 		self.route = {}
 		self.badroute = {}
-		self.time_route = 0
+		self.timers = cnetudp.timerheap()
+		self.server_version = 0
+		self.punch_peers = {}			# ֶ֧ƵĶԶˣԷȷϵժҪ
+		self.punch_cache = {}			# Զ linkdesc(ժҪȫģendpoint)
 		self.cnt_port = 0
 		self.cnt_conv = 0
 		self.logmask = 0
+		self.punch_pps = PUNCH_PPS		# punchingԤ㣺ÿ
+		self.punch_tokens = 0.0
+		self.punch_time = self.current
+		self.punch_queue = []			# (ȼ, , Զ, ַ, ʽ, hack)
+		self.punch_pending = {}			# Զڶе hello
+		self.predict_pending = {}		# ԶڶеԤ˿ hack
+		self.punch_seq = 0
+		self.punch_predict = 0			# Գ nat˿Ԥⴰڣ0ΪԤ
+		self.predict_sent = 0			# Ԥ˿ڵİ
+		self.predict_hit = 0			# Ԥ˿ڽͨ·
+		self.cache_file = None			# ·ɻļNoneΪʹ
+		self.cache = {}					# (uid, key, linkdesc) -> (best, ʱ)
+		self.cache_dirty = False
+		self.cache_time = 0
+		self.handlers = {}				# cmd -> [, , ֽ, ʱ]
+		self.unhandled = [self._process, 0, 0, 0.0]
+		self.profile = False			# Ƿͳƴʱ
+		self.register(CMD_HELLO, self._recv_hello)
+		self.register(CMD_HACK, self._recv_hack)
+		self.register(CMD_TOUCH, self._recv_touch)
+		self.register(CMD_TACK, self._recv_tack)
+		self.register(CMD_PING, self._recv_ping)
+		self.register(CMD_PACK, self._recv_pack)
 	
 	# 磺ָȫΨһ uid룬ȻǶ˿ڼ stun
-	def init (self, uid, passwd, port = 0, server = None):
+	# batchʱʹշһ updateеͳһ
+	def init (self, uid, passwd, port = 0, server = None, batch = 0):
 		self.quit()
 		self.uid = int(long(uid) & 0x7fffffff)
 		self.key = int(long(passwd) & 0x7fffffff)
-		self.network.open(port, server)
+		self.network.open(port, server, batch = batch)
+		self.network.classify = classify
+		self.server_version = self.network.server_version
 		self.current = time.time()
-		self.time_route = self.current
+		self.punch_time = self.current
+		self.punch_tokens = self.punch_pps * PUNCH_BURST
 		self._cnt_port = (((uid >> 16) + (uid & 0xffff)) % 9 + 1) * 1000
 		self._cnt_conv = ((uid >> 16) + (uid & 0xffff)) & 0xffff
 		self._cnt_conv += long(time.time() * 1000000) % 1000000
 		return 0
 	
-	# ر
+	# ر磺·ɻʱдļ
 	def quit (self):
+		if self.cache_dirty:
+			self.cache_save()
 		self.network.close()
 		self.sndque.clear()
 		self.rcvque.clear()
 		self.route = {}
 		self.badroute = {}
+		self.timers.clear()
+		self.punch_peers = {}
+		self.punch_cache = {}
+		self.punch_queue = []
+		self.punch_pending = {}
+		self.predict_pending = {}
 		return 0
 	
 	# ȡñĵַб
@@ -275,8 +493,7 @@ class hostbase(object):
 	
 	#  UDPݣЭͷݣԶ̵ַǷת
 	def sendudp (self, head, data, remote, forward = 0):
-		rawdata = head.marshal() + data
-		self.network.send(rawdata, remote, forward)
+		self.network.send((head.marshal(), data), remote, forward)
 		return 0
 	
 	#  UDPݣЭͷݣԶ̵ַǷת
@@ -287,11 +504,11 @@ class hostbase(object):
 			if forward < 0: # ûϢ
 				return None, '', None, -1
 			try:	
-				head = msghead().unmarshal(rawdata[:32])
+				head = msghead().unmarshal(rawdata)
 				data = rawdata[32:]
 				return head, data, remote, forward
 			except:			# Ϣ󣬺
-				pass
+				self.network.discard('malformed')
 		return None, '', None, -1
 	
 	#  ping
@@ -308,66 +525,338 @@ class hostbase(object):
 		self.sendudp(newhead, data, remote, forward)
 		return 0
 	
-	#  ping_ack
+	#  ping_ackͨ·̽ĻӦΪ "ʱ," routingͳƣ
+	# ̽Ȿӳ routingʹӵ active
 	def _recv_pack (self, head, data, remote, forward):
+		record = data.split(',')
 		try:
-			timestamp = float(data)
+			timestamp = float(record[0])
+			seq = (len(record) > 1) and int(record[1]) or 0
 		except:
 			return -1
-		rtt = self.current - timestamp
+		rtt = min(30.0, max(0.001, self.current - timestamp))
 		ident = head.suid, head.skey
-		if ident in self.route:
-			self.route[ident].active()
+		route = self.route.get(ident)
+		if route is None or seq <= 0:
+			return 0
+		if route.measure(seq, rtt, self.current):
+			self._route_migrate(ident, route)
+		return 0
+
+	# ͨ·̽⣺ÿ̽ͨ·ͨ· ping
+	def _route_probe (self, route):
+		best = route.best
+		for key, seq in route.probe(self.current):
+			head = msghead(self.uid, self.key, route.uid, route.key, \
+				cmd = CMD_PING)
+			text = '%.6f,%d'%(self.current, seq)
+			self.sendudp(head, text, key[2], key[3])
+		if route.best is not best:
+			self._route_migrate((route.uid, route.key), route)
+		return 0
+
+	# ͨ·лˣroute.bestǨʹø·ɵ
+	def _route_migrate (self, ident, route):
+		if self.cache_file:
+			self._cache_store(route)
+		if self.trace and (self.logmask & LOG_ROUTE):
+			best = route.best
+			self.trace('<migrate: %s %d %s %d>'%(cnetudp.ep2text(best[1]), \
+				best[2], cnetudp.ep2text(best[3]), best[4]))
 		return 0
 	
+	# ¼ԶǷֶ֧ punchingconvΪ PUNCH_VERSIONʾ֧
+	def _punch_check (self, head):
+		ident = (head.suid, head.skey)
+		if head.conv == PUNCH_VERSION:
+			if not ident in self.punch_peers:
+				if len(self.punch_peers) >= PUNCH_LIMIT:
+					self.punch_peers = {}
+				self.punch_peers[ident] = None
+		elif ident in self.punch_peers:
+			del self.punch_peers[ident]
+		return 0
+
+	# ·ϢHACK/TOUCH/TACKʱΪ루㣩
+	def _punch_pack (self, ts, addr1, mode1, addr2, mode2, flags = 0, \
+			digest = _punch_empty):
+		ipcache = _punch_ipcache
+		ip1 = ipcache.get(addr1[0]) or _punch_ip(addr1[0])
+		ip2 = ipcache.get(addr2[0]) or _punch_ip(addr2[0])
+		return _punch_route.pack(PUNCH_VERSION, flags, long(ts * 1000000), \
+			ip1, addr1[1], mode1, ip2, addr2[1], mode2, digest)
+
+	# ·Ϣ (flags, ts, addr1, mode1, addr2, mode2, digest)
+	# ıϢ flagsΪ -1ʽʱ None
+	def _punch_parse (self, data):
+		if data[:1] == chr(PUNCH_VERSION):
+			try:
+				record = _punch_route.unpack_from(data)
+			except struct.error:
+				return None
+			ipcache = _punch_ipcache
+			addr1 = (ipcache.get(record[3]) or _punch_ip(record[3]), record[4])
+			addr2 = (ipcache.get(record[6]) or _punch_ip(record[6]), record[7])
+			return (record[1], record[2] * 0.000001, addr1, record[5], \
+				addr2, record[8], record[9])
+		record = data.split(',')
+		if len(record) != 5:
+			return None
+		try:
+			timestamp = float(record[0])
+			addr1 = cnetudp.text2ep(record[1])
+			mode1 = int(record[2])
+			addr2 = cnetudp.text2ep(record[3])
+			mode2 = int(record[4])
+		except:
+			return None
+		return (-1, timestamp, addr1, mode1, addr2, mode2, None)
+
+	# ·ϢԷ֧ʱöƣı
+	def _punch_send (self, cmd, uid, key, ts, addr1, mode1, addr2, mode2, \
+			remote, forward, flags = 0, digest = _punch_empty):
+		head = msghead(self.uid, self.key, uid, key, cmd = cmd, \
+			conv = PUNCH_VERSION)
+		if (uid, key) in self.punch_peers:
+			text = self._punch_pack(ts, addr1, mode1, addr2, mode2, \
+				flags, digest)
+		else:
+			text = '%.6f,%s,%s,%s,%s'%(ts, cnetudp.ep2text(addr1), mode1, \
+				cnetudp.ep2text(addr2), mode2)
+		self.sendudp(head, text, remote, forward)
+		self.punch_tokens = max(self.punch_tokens - 1.0, \
+			-self.punch_pps * PUNCH_BURST)		# ӦͣռԤ
+		return 0
+
+	# ͨ·Ŀԣֱã natֱת
+	def _punch_priority (self, addr, mode):
+		if mode:
+			return 2
+		if cnetudp.iptype(addr[0]) < 10:
+			return 0
+		return 1
+
+	# punchingͣ punch_ppsƣӶаȼ hello
+	# жԶ˵ľѡַԺŷ natģתhack
+	# Ϊ NoneԤ˿ڻӦ hack(ʱ, ַ, ʽ, ժҪ)
+	def _punch_flush (self):
+		pps = self.punch_pps
+		if pps > 0:
+			elapsed = max(0.0, self.current - self.punch_time)
+			self.punch_tokens = min(self.punch_tokens + elapsed * pps, \
+				pps * PUNCH_BURST)
+		self.punch_time = self.current
+		queue = self.punch_queue
+		while queue and (pps <= 0 or self.punch_tokens >= 1.0):
+			priority, seq, ident, addr2, mode2, hack = heapq.heappop(queue)
+			if hack is not None:
+				count = self.predict_pending.get(ident, 0) - 1
+				if count > 0:
+					self.predict_pending[ident] = count
+				else:
+					self.predict_pending.pop(ident, None)
+				self._send_hack(ident[0], ident[1], hack[0], addr2, mode2, \
+					hack[1], hack[2], hack[3])		# ѾռԤ
+				continue
+			count = self.punch_pending.get(ident, 0) - 1
+			if count > 0:
+				self.punch_pending[ident] = count
+			else:
+				self.punch_pending.pop(ident, None)
+			route = self.route.get(ident)
+			if route is None:		# ·Ѿɾ
+				continue
+			self._hello_send(ident, route.linkdesc, addr2, mode2)
+			self.punch_tokens -= 1.0
+		return 0
+
+	# ˫ natжֱܷԳͶԶԳͻ߶˿ʱ
+	# Էӳ˿޷Ԥ֪򶴲ɹ˫ natַͬ
+	# ͬһʱȻñصֱַ򿪶˿ԤⲢҶԳ
+	# һĶ˿ڲ֪ʱԳͶԶ˿ȻԳ
+	def _punch_hopeless (self, linkdesc):
+		try:
+			endpoint = cnetudp.endpoint().unmarshal(linkdesc)
+		except:
+			return False
+		nat1, nat2 = self.network.nattype, endpoint.nattype
+		if nat1 != cnetudp.NAT_SYMMETRIC and nat2 != cnetudp.NAT_SYMMETRIC:
+			return False
+		hard = (cnetudp.NAT_SYMMETRIC, cnetudp.NAT_RESTRICT)
+		if not (nat1 in hard and nat2 in hard):
+			return False
+		if self.punch_predict > 0 and nat1 != nat2:
+			if nat1 == cnetudp.NAT_SYMMETRIC:
+				delta = self.network.natdelta
+			else:
+				delta = endpoint.natdelta
+			if delta:
+				return False
+		if self.network.nat and endpoint.nat:
+			if self.network.nat[0] == endpoint.nat[0]:
+				return False
+		return True
+
+	# Գ nat˿Ԥ⣺Է˿뱸ö˿ڵӳֱΪ port
+	#  port + delta֮ĿӳΪ port + delta * 2 ...
+	# Щ˿ڷԴ򿪱 natǵĹˡֻжԷǶԳ͡
+	# ǲҲͬһ natʱԤ⣬ [(ַ, 0), ...]
+	def _punch_predict (self, endpoint):
+		window = self.punch_predict
+		if window <= 0 or not endpoint.natdelta or not endpoint.nat:
+			return []
+		if endpoint.nattype != cnetudp.NAT_SYMMETRIC:
+			return []
+		if self.network.nattype in (cnetudp.NAT_UNKNOWN, \
+				cnetudp.NAT_SYMMETRIC):
+			return []
+		if self.network.nat and self.network.nat[0] == endpoint.nat[0]:
+			return []
+		ip, port = endpoint.nat
+		delta = endpoint.natdelta
+		predict = []
+		for i in xrange(2, window + 2):
+			p = port + delta * i
+			if p > 0 and p < 0x10000:
+				predict.append(((ip, p), 0))
+		return predict
+
 	# ӷ(addr1, mode1) ӷ(addr2, mode2)
 	# cmd_hello = timestamp + addr2 + mode2 + linkdesc1
+	# Էÿѡַ͵ helloȽ punch_queue _punch_flush
+	# Ԥ㷢͡һֻûзĶԶһ
 	def _send_hello (self, duid, dkey, linkdesc):
-		head = msghead(self.uid, self.key, duid, dkey, cmd = CMD_HELLO)
-		endpoint = cnetudp.endpoint().unmarshal(linkdesc)
+		ident = (duid, dkey)
+		if self.punch_pending.get(ident, 0) > 0:
+			return 0
+		try:
+			endpoint = cnetudp.endpoint().unmarshal(linkdesc)
+		except:
+			return -1
 		destination = cnetudp.destination(endpoint)
-		timestamp = '%.f'%self.current
+		route = self.route.get(ident)
+		if route is not None and route.relay:		# ֻת hello
+			destination = [ (a, m) for a, m in destination if m ]
+		predict = self._punch_predict(endpoint)
+		if predict:			# Ԥ˿ں natַͬתǰ
+			if route is not None:
+				route.predicted.update([ a for a, m in predict ])
+			destination = destination + predict
+			self.predict_sent += len(predict)
+		for addr2, mode2 in destination:
+			priority = self._punch_priority(addr2, mode2)
+			self.punch_seq += 1
+			heapq.heappush(self.punch_queue, (priority, self.punch_seq, \
+				ident, addr2, mode2, None))
+		if destination:
+			self.punch_pending[ident] = len(destination)
+		self._punch_flush()
+		return 0
+
+	# һ helloʱΪʵʷ͵ʱ
+	def _hello_send (self, ident, linkdesc, addr2, mode2):
+		head = msghead(self.uid, self.key, ident[0], ident[1], \
+			cmd = CMD_HELLO, conv = PUNCH_VERSION)
 		linkdesc1 = self.linkdesc()
 		if linkdesc[:10] == '127.0.0.1:':
 			linkdesc1 = self.localhost()
-		for addr2, mode2 in destination:
-			text = '%s,%s,%s,'%(timestamp, cnetudp.ep2text(addr2), mode2)
+		if ident in self.punch_peers:	# ԷȷϹժҪʱٷȫ
+			digest = punch_digest(linkdesc1)
+			flags = (self.punch_peers[ident] != digest) and PUNCH_FULL or 0
+			ts = long(self.current * 1000000)
+			text = _punch_hello.pack(PUNCH_VERSION, flags, ts, \
+				socket.inet_aton(addr2[0]), addr2[1], mode2, digest)
+			if flags & PUNCH_FULL:
+				text += linkdesc1
+		else:
+			text = '%.6f,%s,%s,'%(self.current, cnetudp.ep2text(addr2), \
+				mode2)
 			text += linkdesc1
-			if self.trace and (self.logmask & LOG_HELLO):
-				self.trace('<hello: %s %d>'%(cnetudp.ep2text(addr2), mode2))
-				#print '_send_hello: %s %d'%(addr2, mode2)
-			self.sendudp(head, text, addr2, mode2)
+		if self.trace and (self.logmask & LOG_HELLO):
+			self.trace('<hello: %s %d>'%(cnetudp.ep2text(addr2), mode2))
+		self.sendudp(head, text, addr2, mode2)
 		return 0
 	
-	#  hello: ݽշ linkdescշпͨ· hack
+	#  hello: ݽշ linkdescշпͨ· hack
+	# Ԥ˿ڵ hack punch_queueԤ㷢ͣÿԶͬʱֻ
+	# һԤⴰڶУһûзʱԤ
 	def _recv_hello (self, head, data, remote, forward):
-		record = data.split(',')
-		if len(record) != 4:
-			return -1
-		timestamp = record[0]
-		try:
-			addr2 = cnetudp.text2ep(record[1])	# ȡôģַ
-			mode2 = int(record[2])				# ȡôģǷת
+		self._punch_check(head)
+		ident = (head.suid, head.skey)
+		digest = _punch_empty
+		if data[:1] == chr(PUNCH_VERSION):
+			try:
+				record = _punch_hello.unpack_from(data)
+				addr2 = (socket.inet_ntoa(record[3]), record[4])
+			except:
+				return -1
+			flags, timestamp, mode2 = record[1], record[2] * 0.000001, record[5]
+			digest = record[6]
+			if flags & PUNCH_FULL:
+				linkdesc = data[_punch_hello.size:]
+			else:
+				cache = self.punch_cache.get(ident)
+				if cache is None or cache[0] != digest:	#  linkdesc
+					self._punch_send(CMD_HACK, head.suid, head.skey, \
+						timestamp, remote, forward, addr2, mode2, \
+						remote, forward, PUNCH_NEEDFULL)
+					return -1
+				linkdesc = cache[1]
+		else:
+			record = data.split(',')
+			if len(record) != 4:
+				return -1
+			try:
+				timestamp = float(record[0])		# ȡ÷ʱ
+				addr2 = cnetudp.text2ep(record[1])	# ȡôģַ
+				mode2 = int(record[2])				# ȡôģǷת
+			except:
+				return -1
 			linkdesc = record[3]
-			endpoint = cnetudp.endpoint().unmarshal(linkdesc)
-		except:
-			return -1
+			if ident in self.punch_peers:
+				digest = punch_digest(linkdesc)
+		cache = self.punch_cache.get(ident)
+		if cache is not None and cache[1] == linkdesc:	# Ѿ
+			endpoint = cache[2]
+		else:
+			try:
+				endpoint = cnetudp.endpoint().unmarshal(linkdesc)
+			except:
+				return -1
+			if digest != _punch_empty:	# Էֶ֧ƣ¼ linkdesc
+				if len(self.punch_cache) >= PUNCH_LIMIT:
+					self.punch_cache = {}
+				self.punch_cache[ident] = (digest, linkdesc, endpoint)
 		destination = cnetudp.destination(endpoint, remote, forward)
 		if self.trace and (self.logmask & LOG_HELLO):
 			self.trace('<recv hello: %s %d %s %d>'%(cnetudp.ep2text(remote),\
 				forward, cnetudp.ep2text(addr2), mode2))
 		for addr1, mode1 in destination:
 			self._send_hack(head.suid, head.skey, timestamp, \
-				addr1, mode1, addr2, mode2)
+				addr1, mode1, addr2, mode2, digest)
+		predict = []
+		if not ident in self.predict_pending:
+			if len(self.predict_pending) < PUNCH_LIMIT:
+				predict = self._punch_predict(endpoint)
+		predict = [ n for n in predict if n not in destination ]
+		if predict:			# ԷԤĶ˿ڻӦ򿪱Ĺ
+			hack = (timestamp, addr2, mode2, digest)
+			for addr1, mode1 in predict:
+				priority = self._punch_priority(addr1, mode1)
+				self.punch_seq += 1
+				heapq.heappush(self.punch_queue, (priority, self.punch_seq, \
+					ident, addr1, mode1, hack))
+			self.predict_pending[ident] = len(predict)
+			self.predict_sent += len(predict)
+			self._punch_flush()
 		return 0
 	
 	# ӷ(addr1, mode1) ӷ(addr2, mode2)
-	# cmd_hack = timestamp + addr1 + mode1 + addr2 + mode2
-	def _send_hack (self, uid, key, ts, addr1, mode1, addr2, mode2):
-		head = msghead(self.uid, self.key, uid, key, cmd = CMD_HACK)
-		text = '%s,%s,%s,%s,%s'%(ts, cnetudp.ep2text(addr1), mode1, \
-			cnetudp.ep2text(addr2), mode2)
-		self.sendudp(head, text, addr1, mode1)
+	# cmd_hack = timestamp + addr1 + mode1 + addr2 + mode2 (+ ժҪ)
+	def _send_hack (self, uid, key, ts, addr1, mode1, addr2, mode2, \
+			digest = _punch_empty):
+		self._punch_send(CMD_HACK, uid, key, ts, addr1, mode1, addr2, \
+			mode2, addr1, mode1, 0, digest)
 		if self.trace and (self.logmask & LOG_HACK):
 			self.trace('<hack %s %d %s %d>'%(cnetudp.ep2text(addr1), mode1,\
 				cnetudp.ep2text(addr2), mode2))
@@ -376,25 +865,24 @@ class hostbase(object):
 	
 	# ӷ(addr1, mode1) ӷ(addr2, mode2)
 	def _recv_hack (self, head, data, remote, forward):
-		record = data.split(',')
-		if len(record) != 5:
-			return -1
-		try:
-			timestamp = float(record[0])
-			addr1 = cnetudp.text2ep(record[1])
-			mode1 = int(record[2])
-			addr2 = cnetudp.text2ep(record[3])
-			mode2 = int(record[4])
-		except:
+		self._punch_check(head)
+		record = self._punch_parse(data)
+		if record is None:
 			return -1
+		flags, timestamp, addr1, mode1, addr2, mode2, digest = record
+		ident = (head.suid, head.skey)
+		if flags >= 0 and ident in self.punch_peers:
+			if flags & PUNCH_NEEDFULL:		# һ hello linkdesc
+				self.punch_peers[ident] = None
+				return 0
+			self.punch_peers[ident] = digest	# ԷѾ linkdesc
 		rtt = self.current - timestamp
 		rtt = min(30.0, max(0.001, rtt))
 		route = [ (rtt, addr1, mode1, addr2, mode2) ]
 		if remote != addr2 or forward != mode2:
 			route.append((rtt, addr1, mode1, remote, forward))
-		timestamp = '%.6f'%self.current
 		for rtt, addr1, mode1, addr2, mode2 in route: 
-			self._send_touch(head.suid, head.skey, timestamp, 
+			self._send_touch(head.suid, head.skey, self.current, 
 				addr1, mode1, addr2, mode2)
 		if self.trace and (self.logmask & LOG_HACK):
 			self.trace('<recv hack: %s %d %s %d>'%(cnetudp.ep2text(addr1), \
@@ -403,54 +891,47 @@ class hostbase(object):
 	
 	# touchϢ
 	def _send_touch (self, uid, key, ts, addr1, mode1, addr2, mode2):
-		head = msghead(self.uid, self.key, uid, key, cmd = CMD_TOUCH)
-		text = '%s,%s,%s,%s,%s'%(ts, cnetudp.ep2text(addr1), mode1, \
-			cnetudp.ep2text(addr2), mode2)
-		self.sendudp(head, text, addr2, mode2)
+		self._punch_send(CMD_TOUCH, uid, key, ts, addr1, mode1, addr2, \
+			mode2, addr2, mode2)
 	
 	# tackϢ
 	def _send_tack (self, uid, key, ts, addr1, mode1, addr2, mode2):
-		head = msghead(self.uid, self.key, uid, key, cmd = CMD_TACK)
-		text = '%s,%s,%s,%s,%s'%(ts, cnetudp.ep2text(addr1), mode1, \
-			cnetudp.ep2text(addr2), mode2)
-		self.sendudp(head, text, addr1, mode1)
+		self._punch_send(CMD_TACK, uid, key, ts, addr1, mode1, addr2, \
+			mode2, addr1, mode1)
 	
 	#  touch
 	def _recv_touch (self, head, data, remote, forward):
-		record = data.split(',')
-		if len(record) != 5:
-			return -1
-		try:
-			timestamp = record[0]
-			addr1 = cnetudp.text2ep(record[1])
-			mode1 = int(record[2])
-			addr2 = cnetudp.text2ep(record[3])
-			mode2 = int(record[4])
-		except:
+		self._punch_check(head)
+		record = self._punch_parse(data)
+		if record is None:
 			return -1
+		flags, timestamp, addr1, mode1, addr2, mode2, digest = record
 		self._send_tack(head.suid, head.skey, timestamp, \
 			addr1, mode1, addr2, mode2)
 		return 0
 	
 	#  tack
 	def _recv_tack (self, head, data, remote, forward):
-		record = data.split(',')
-		if len(record) != 5:
-			return -1
-		try:
-			timestamp = float(record[0])
-			addr1 = cnetudp.text2ep(record[1])
-			mode1 = int(record[2])
-			addr2 = cnetudp.text2ep(record[3])
-			mode2 = int(record[4])
-		except:
+		self._punch_check(head)
+		record = self._punch_parse(data)
+		if record is None:
 			return -1
+		flags, timestamp, addr1, mode1, addr2, mode2, digest = record
 		rtt = self.current - timestamp
 		rtt = min(30.0, max(0.001, rtt))
 		if self.trace and (self.logmask & LOG_TACK):
 			self.trace('<recv tack: %s %d %s %d>'%(cnetudp.ep2text(addr1), \
 				mode1, cnetudp.ep2text(addr2), mode2))
 		self._newroute(head.suid, head.skey, rtt, addr1, mode1, addr2, mode2)
+		route = self.route.get((head.suid, head.skey))
+		if route and addr2 in route.predicted:
+			route.predicted.discard(addr2)
+			self.predict_hit += 1
+		if route and route.state == 0 and route.cached is not None:
+			if route.cached == (addr1, mode1, addr2, mode2):
+				route.state = 1			# ͨ·֤ͨٵȴ
+				self.timers.schedule(('route', (route.uid, route.key)), \
+					self.current)
 		return 0
 	
 	# һ·ӷյ tackԺ
@@ -465,6 +946,7 @@ class hostbase(object):
 			route.active()
 			route.newroute(rtt, addr1, mode1, addr2, mode2)
 			route.update(self.current)
+			self.timers.schedule(('route', ident), route.deadline())
 		return 0
 	
 	# ȡ·Էuid, keyԼ linkdesc
@@ -480,13 +962,102 @@ class hostbase(object):
 				del self.route[ident]
 		if not ident in self.route:		# Զ routing󲢷 hello
 			route = routing(uid, key, linkdesc, self.current)
+			route.relay = self._punch_hopeless(linkdesc)
 			self.route[ident] = route
+			self.timers.schedule(('route', ident), route.deadline())
+			self._cache_touch(route)
 			self._send_hello(uid, key, linkdesc)
 			return None
 		route = self.route[ident]
 		best = route.bestroute()
+		if best and self.cache_file:
+			self._cache_store(route)
 		return best
 	
+	# ·ɻ棺ļȡǰ֤ͨ·֮µ bestڱ仯
+	# Ժ CACHE_SAVE룩Լ quitʱдļļʱ0
+	def cache_open (self, filename):
+		self.cache_file = filename
+		self.cache = {}
+		self.cache_dirty = False
+		try:
+			fp = open(filename, 'r')
+		except IOError:
+			return 0
+		for line in fp:
+			record = line.rstrip('\r\n').split('\t')
+			if len(record) != 5:
+				continue
+			try:
+				uid, key, saved = int(record[0]), int(record[1]), \
+					float(record[2])
+			except:
+				continue
+			best = text2route(record[4])
+			if best is None or self.current - saved > CACHE_AGE:
+				continue
+			self.cache[(uid, key, record[3])] = (best, saved)
+		fp.close()
+		return 0
+
+	# д·ɻļдʱļٸдһļ
+	def cache_save (self):
+		if not self.cache_file:
+			return -1
+		lines = []
+		for (uid, key, linkdesc), (best, saved) in self.cache.iteritems():
+			text = route2text(*best)
+			lines.append('%d\t%d\t%.3f\t%s\t%s\n'%(uid, key, saved, \
+				linkdesc, text))
+		temp = self.cache_file + '.tmp'
+		try:
+			fp = open(temp, 'w')
+			fp.writelines(lines)
+			fp.close()
+			if sys.platform[:3] == 'win' and os.path.exists(self.cache_file):
+				os.remove(self.cache_file)
+			os.rename(temp, self.cache_file)
+		except (IOError, OSError):
+			return -2
+		self.cache_dirty = False
+		self.cache_time = self.current + CACHE_SAVE
+		return 0
+
+	# ¼֤ͨ· CACHE_LIMITʱɾɵһ룬ͨ·
+	# ûб仯ʱһЧڲˢ±ʱ
+	def _cache_store (self, route):
+		entry = (route.uid, route.key, route.linkdesc)
+		cache = self.cache.get(entry)
+		if cache is not None and cache[0] == route.best:
+			if self.current - cache[1] < CACHE_AGE * 0.5:
+				return 0
+		if cache is None and len(self.cache) >= CACHE_LIMIT:
+			items = sorted(self.cache.items(), key = lambda x: x[1][1])
+			for item in items[:len(items) // 2]:
+				del self.cache[item[0]]
+		self.cache[entry] = (route.best, self.current)
+		self.cache_dirty = True
+		return 0
+
+	# ½·ʱ黺棺ͨ·ҷַȻЧʱֱظ
+	# ͨ· touchյ tack·ɣͬʱճ punching
+	def _cache_touch (self, route):
+		cache = self.cache.get((route.uid, route.key, route.linkdesc))
+		if cache is None:
+			return 0
+		best, saved = cache
+		if self.current - saved > CACHE_AGE:
+			return 0
+		rtt, addr1, mode1, addr2, mode2 = best
+		ep = self.network.ep
+		if addr1 != ep.nat and (not addr1 in ep.local):
+			if addr1 != ('127.0.0.1', self.network.port):
+				return 0			# ҷַˣ˿ڣЧ
+		route.cached = (addr1, mode1, addr2, mode2)
+		self._send_touch(route.uid, route.key, self.current, addr1, mode1, \
+			addr2, mode2)
+		return 1
+	
 	# ·Ҫɾ
 	def active (self, uid, key):
 		ident = (uid, key)
@@ -500,44 +1071,79 @@ class hostbase(object):
 		ident = (uid, key)
 		if ident in self.route:
 			del self.route[ident]
+			self.timers.cancel(('route', ident))
 		return 0
 	
-	# ·ɸ£ɨڵ·ɲʵʱظ hello pingɾ
-	def _route_update (self):
-		for ident, route in self.route.items():
+	# ·ɸ£ֻ¶ʱڵ·ɣʵʱظ hello ping
+	# ɾ
+	def _route_update (self, fired):
+		for kind, ident in fired:
+			if kind != 'route' or not ident in self.route:
+				continue
+			route = self.route[ident]
 			code = route.update(self.current)
 			if code == 1:
 				self._send_hello(route.uid, route.key, route.linkdesc)
 			elif code == -1:
 				del self.route[ident]
+				continue
 			elif code == -2:
 				del self.route[ident]
-				self.badroute[ident] = self.local
+				self.badroute[ident] = self.current
+				continue
+			self._route_probe(route)
+			self.timers.schedule(('route', ident), route.deadline())
+		return 0
+	
+	# л natַ仯µ linkdescжԶ·
+	# helloеͨ·ʹãҵĸõͨ·滻
+	def _route_refresh (self):
+		for ident, route in self.route.items():
+			route.active()
+			self._send_hello(route.uid, route.key, route.linkdesc)
 		return 0
 	
-	# Ϣַ·ɼ͸ϢϢ _process
+	# עϢhandler(head, data, remote, forward) __init__
+	# еӻ滻עͳ
+	def register (self, cmd, handler):
+		self.handlers[cmd] = [handler, 0, 0, 0.0]
+		return 0
+
+	# Ϣַôûע _process
+	# ͬʱۼÿİֽڣprofileΪʱۼƴʱ
 	def _dispatch (self, head, data, remote, forward):
-		cmd = head.cmd
-		if cmd == CMD_HELLO:
-			self._recv_hello(head, data, remote, forward)
-		elif cmd == CMD_HACK:
-			self._recv_hack(head, data, remote, forward)
-		elif cmd == CMD_TOUCH:
-			self._recv_touch(head, data, remote, forward)
-		elif cmd == CMD_TACK:
-			self._recv_tack(head, data, remote, forward)
-		elif cmd == CMD_PING:
-			self._recv_ping(head, data, remote, forward)
-		elif cmd == CMD_PACK:
-			self._recv_pack(head, data, remote, forward)
+		entry = self.handlers.get(head.cmd, self.unhandled)
+		entry[1] += 1
+		entry[2] += len(data)
+		if not self.profile:
+			entry[0](head, data, remote, forward)
 		else:
-			self._process (head, data, remote, forward)
+			ts = time.time()
+			entry[0](head, data, remote, forward)
+			entry[3] += time.time() - ts
 		return 0
 	
-	# ·ɼ͸ϢԼʵ
+	# ûעϢԼʵ
 	def _process (self, head, data, remote, forward):
 		return 0
 
+	# ַͳƣ{ cmd: (, ֽ, ʱ) }ûע cmd -1
+	# ֻгյ
+	def statistic_dispatch (self, reset = False):
+		result = {}
+		items = self.handlers.items() + [ (-1, self.unhandled) ]
+		for cmd, entry in items:
+			if entry[1] > 0:
+				result[cmd] = (entry[1], entry[2], entry[3])
+			if reset:
+				entry[1], entry[2], entry[3] = 0, 0, 0.0
+		return result
+
+	# ʱԼʵ֣֮ǰãfiredΪε
+	# Ķʱ keyб timers
+	def _tick (self, fired):
+		return 0
+
 	# һµĶ˿ں
 	def _gen_port (self):
 		self._cnt_port += 1
@@ -567,9 +1173,46 @@ class hostbase(object):
 			if forward < 0: break
 			if head.duid == self.uid and head.dkey == self.key:
 				self._dispatch (head, data, remote, forward)
-		if self.current > self.time_route:
-			self.time_route = self.current + 0.1
-			self._route_update()
+			else:
+				self.network.discard('unknown')
+		if self.server_version != self.network.server_version:
+			self.server_version = self.network.server_version
+			self._route_refresh()
+		fired = self.timers.expire(self.current)
+		self._route_update(fired)
+		self._punch_flush()
+		if self.cache_dirty and self.current >= self.cache_time:
+			self.cache_save()
+		self._tick(fired)
+		self.network.flush()
+		return 0
+
+	# ȡ׽֣ cnetudp.waitfor
+	def fileno (self):
+		return self.network.fileno()
+
+	# һҪ updateʱ䣺籣ʱĶʱԼ
+	# punchingзǿʱһƵʱ
+	def deadline (self):
+		deadline = self.network.deadline()
+		t = self.timers.deadline()
+		if t is not None and (deadline is None or t < deadline):
+			deadline = t
+		if self.punch_queue and self.punch_pps > 0:
+			t = self.punch_time + (1.0 - self.punch_tokens) / self.punch_pps
+			if deadline is None or t < deadline:
+				deadline = t
+		return deadline
+
+	# ȴֱյݻ߶ʱڣȻ update
+	def wait (self, timeout = None):
+		cnetudp.waitfor([ self ], timeout)
+		return self.update()
+
+	# ¼ѭֱر
+	def run (self):
+		while self.network.sock:
+			self.wait()
 		return 0
 
 
@@ -829,6 +1472,67 @@ if __name__ == '__main__':
 		route = text2route(text)
 		print route
 
+	# ܲԣHACK/TOUCH/TACKıʽƸʽԱ
+	def test5(count = 100000):
+		host = hostbase()
+		addr1, addr2 = ('192.168.10.214', 4000), ('202.108.8.40', 20000)
+		current = time.time()
+		def text_pack():
+			return '%.6f,%s,%s,%s,%s'%(current, cnetudp.ep2text(addr1), 0, \
+				cnetudp.ep2text(addr2), 1)
+		def binary_pack():
+			return host._punch_pack(current, addr1, 0, addr2, 1)
+		for name, pack in (('text', text_pack), ('binary', binary_pack)):
+			data = pack()
+			ts = time.time()
+			for i in xrange(count):
+				pack()
+			t1 = time.time() - ts
+			ts = time.time()
+			for i in xrange(count):
+				host._punch_parse(data)
+			t2 = time.time() - ts
+			print '%-6s size=%d pack=%.2fus parse=%.2fus'%(name, len(data), \
+				t1 * 1000000 / count, t2 * 1000000 / count)
+
+	# ܲԣԭ __dict__νʽЭͷڵĶԱ
+	def test6(count = 200000):
+		class oldhead(object):
+			def __init__ (self, suid = 0, skey = 0, duid = 0, dkey = 0, \
+					sport = 0, dport = 0, cmd = 0, conv = 0):
+				self.suid, self.skey, self.duid, self.dkey = \
+					suid, skey, duid, dkey
+				self.sport, self.dport, self.cmd, self.conv = \
+					sport, dport, cmd, conv
+				self.raw = ''
+			def marshal (self):
+				self.raw = struct.pack('!llllllll', self.suid, self.skey, \
+					self.duid, self.dkey, self.sport, self.dport, \
+					self.cmd, self.conv)
+				return self.raw
+			def unmarshal (self, data):
+				if len(data) != 32:
+					raise Exception('header size is not 32')
+				record = struct.unpack('!llllllll', data)
+				self.suid, self.skey, self.duid, self.dkey = record[:4]
+				self.sport, self.dport, self.cmd, self.conv = record[4:]
+				self.raw = data
+				return self
+		args = (20013080, 123, 20013070, 456, 1, 2, CMD_DATA, 3)
+		old, new = oldhead(*args), msghead(*args)
+		data = new.marshal() + 'x' * 1000
+		view = memoryview(data)
+		tests = (('old marshal', old.marshal), ('marshal', new.marshal), \
+			('old unmarshal', lambda: oldhead(*args).unmarshal(data[:32])), \
+			('unmarshal', lambda: msghead(*args).unmarshal(data)), \
+			('memoryview', lambda: msghead(*args).unmarshal(view, 0)))
+		for name, func in tests:
+			ts = time.time()
+			for i in xrange(count):
+				func()
+			ts = time.time() - ts
+			print '%-14s %.3fus'%(name, ts * 1000000 / count)
+
 	plog('hahahahah')
 	test1()
 	# cnetgem.py cnetdew cnetlax.py
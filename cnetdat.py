@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 #======================================================================
 #
-# cnetdat.py - simple reliable data protocol (no congestion control)
+# cnetdat.py - simple reliable data protocol (pluggable congestion control)
 #
 # NOTE:
 # for more information, please see the readme file.
@@ -12,7 +12,7 @@ import sys
 import time
 import struct
 import collections
-
+import heapq
 
 
 #----------------------------------------------------------------------
@@ -20,6 +20,18 @@ import collections
 #----------------------------------------------------------------------
 SEG_DAT		= 0x5000
 SEG_ACK		= 0x5001
+SEG_SACK	= 0x5002		# ۻȷ + ѡȷ
+
+SACK_RANGES	= 8			# SEG_SACK䣬0Ϊʹ SEG_SACK
+FAST_RESEND	= 3			# 󷢵ĶαȷϼξͿش0Ϊʹ
+WND_PROBE	= 5.0		# 㴰̽룩
+
+CC_INIT		= 4			# ӵڳʼֵ
+CC_MIN		= 2			# ӵСֵ
+CC_TARGET	= 50		# ӳٵĿƣĿŶӳ٣룩
+CC_GAIN		= 1.0		# ӳٵĿƣÿ RTT
+CC_BASE		= 10.0		# ӳٵĿƣС RTTÿͳƵʱ䣨룩
+CC_HISTORY	= 6			# ӳٵĿƣС RTT
 
 #----------------------------------------------------------------------
 # segment - ݶ
@@ -48,6 +60,193 @@ class segment(object):
 		return self
 
 
+#----------------------------------------------------------------------
+# congestion - ӵƣ಻ƣڹ̶Ϊ snd_wnd
+# reliableڷǰ window()δȷϵĶյȷʱ
+# acked(rtt)rttΪ룬ЧʱΪ -1γʱشʱ lost(seq)
+# ȷϵشǰһʱشǶģ spurious(seq)
+#  _save()/_restore()漰ָ״̬ڳ
+#----------------------------------------------------------------------
+class congestion(object):
+	
+	def __init__ (self, reliable):
+		self.reliable = reliable
+		self.cwnd = float(reliable.snd_wnd)
+		self.recover = -1			# ֶָյ㣺ֻһδ
+		self.prior = None			# һμǰ _save()ڳ
+		self.prior_seq = -1			# һμڵĶ
+	
+	# ͬʱδȷϵĶ
+	def window (self):
+		return max(CC_MIN, min(int(self.cwnd), self.reliable.snd_wnd))
+	
+	# յһεȷ
+	def acked (self, rtt):
+		return 0
+
+	# ״̬һΪ cwnd
+	def _save (self):
+		return (self.cwnd,)
+
+	def _restore (self, state):
+		self.cwnd = state[0]
+	
+	# γʱͬһʹеĶֻһӵ
+	def lost (self, seq):
+		if seq < self.recover:
+			return 0
+		self.recover = self.reliable.snd_nxt
+		self.prior = self._save()
+		self.prior_seq = seq
+		return 1
+
+	# ʱشǶģһμڵĶμ
+	def spurious (self, seq):
+		if self.prior is None or seq != self.prior_seq:
+			return 0
+		prior, self.prior = self.prior, None
+		if prior[0] > self.cwnd:
+			self._restore(prior)
+		self.recover = -1
+		return 1
+
+
+#----------------------------------------------------------------------
+# reno - ڶӵƣ + Լ
+#----------------------------------------------------------------------
+class reno(congestion):
+	
+	def __init__ (self, reliable):
+		super(reno, self).__init__ (reliable)
+		self.cwnd = float(CC_INIT)
+		self.ssthresh = float(reliable.snd_wnd)
+	
+	def acked (self, rtt):
+		if self.cwnd < self.ssthresh:
+			self.cwnd += 1.0
+		else:
+			self.cwnd += 1.0 / self.cwnd
+		self.cwnd = min(self.cwnd, float(self.reliable.snd_wnd))
+		return 0
+
+	def _save (self):
+		return (self.cwnd, self.ssthresh)
+
+	def _restore (self, state):
+		self.cwnd, self.ssthresh = state
+	
+	def lost (self, seq):
+		if super(reno, self).lost(seq) == 0:
+			return 0
+		self.ssthresh = max(self.cwnd * 0.5, float(CC_MIN))
+		self.cwnd = self.ssthresh
+		return 1
+
+
+#----------------------------------------------------------------------
+# ledbat - ӳٵӵƣһʱС RTTΪ׼Ŷ
+# ӳٵ CC_TARGETʱ󴰿ڣʱСó
+#----------------------------------------------------------------------
+class ledbat(congestion):
+	
+	def __init__ (self, reliable):
+		super(ledbat, self).__init__ (reliable)
+		self.cwnd = float(CC_INIT)
+		self.slow = True				# Ŷӳٹ򶪰
+		self.history = collections.deque()
+		self.base_time = 0
+	
+	# С RTTÿ CC_BASEһΣȡ CC_HISTORYеСֵ
+	def __base (self, rtt):
+		current = self.reliable.current
+		if not self.history or current >= self.base_time:
+			self.base_time = current + CC_BASE
+			self.history.append(rtt)
+			if len(self.history) > CC_HISTORY:
+				self.history.popleft()
+		elif rtt < self.history[-1]:
+			self.history[-1] = rtt
+		return min(self.history)
+	
+	def acked (self, rtt):
+		if rtt < 0:
+			return 0
+		queuing = rtt - self.__base(rtt)
+		if self.slow and queuing * 2 < CC_TARGET:
+			self.cwnd += 1.0
+		else:
+			self.slow = False
+			offset = (CC_TARGET - queuing) / float(CC_TARGET)
+			self.cwnd += CC_GAIN * offset / self.cwnd
+		self.cwnd = max(float(CC_MIN), self.cwnd)
+		self.cwnd = min(self.cwnd, float(self.reliable.snd_wnd))
+		return 0
+
+	def _save (self):
+		return (self.cwnd, self.slow)
+
+	def _restore (self, state):
+		self.cwnd, self.slow = state
+	
+	def lost (self, seq):
+		if super(ledbat, self).lost(seq) == 0:
+			return 0
+		self.slow = False
+		self.cwnd = max(self.cwnd * 0.5, float(CC_MIN))
+		return 1
+
+
+# ӵ㷨 -> 
+CONGESTION = { 'none': congestion, 'reno': reno, 'ledbat': ledbat }
+
+
+#----------------------------------------------------------------------
+# resendtimer - شʱʱеŶѣȡǰĶʱ
+# ڶ¹ڵļ¼ʱ
+#----------------------------------------------------------------------
+class resendtimer(object):
+
+	def __init__ (self):
+		self.heap = []
+		self.timers = {}			# seq -> ʱ
+
+	# Ǽǣ֤ seq deadline֮ǰڣѾиĶʱ򲻱
+	def schedule (self, seq, deadline):
+		timer = self.timers.get(seq)
+		if timer is not None and timer <= deadline:
+			return 0
+		self.timers[seq] = deadline
+		heapq.heappush(self.heap, (deadline, seq))
+		if len(self.heap) > len(self.timers) * 2 + 64:
+			self.heap = [ (t, s) for s, t in self.timers.iteritems() ]
+			heapq.heapify(self.heap)
+		return 0
+
+	def cancel (self, seq):
+		self.timers.pop(seq, None)
+		return 0
+
+	# ȡеڵţͬʱȡǵĶʱ
+	def expire (self, current):
+		heap, timers = self.heap, self.timers
+		fired = []
+		while heap and heap[0][0] <= current:
+			deadline, seq = heapq.heappop(heap)
+			if timers.get(seq) == deadline:
+				del timers[seq]
+				fired.append(seq)
+		return fired
+
+	# ĵʱ䣬ûжʱʱ None
+	def deadline (self):
+		heap, timers = self.heap, self.timers
+		while heap:
+			if timers.get(heap[0][1]) == heap[0][0]:
+				return heap[0][0]
+			heapq.heappop(heap)
+		return None
+
+
 #----------------------------------------------------------------------
 # reliable - Эƶ
 #----------------------------------------------------------------------
@@ -65,8 +264,10 @@ class reliable(object):
 		self.rx_rto = 300
 		self.rx_minrto = 10
 		self.snd_wnd = 64
-		self.rcv_wnd = 64
+		self.rcv_wnd = 128			# δȡߵݣ snd_wnd
 		self.snd_buf = {}
+		self.snd_timer = resendtimer()	# ͻиεشʱ
+		self.snd_order = collections.OrderedDict()	# δȷϵĶΣ˳
 		self.rcv_buf = {}
 		self.ack_lst = []
 		self.mtu = mtu
@@ -79,6 +280,27 @@ class reliable(object):
 		self.timestamp = long(current * 1000) & 0xffffffff
 		self.id = id
 		self.state = 0
+		self.throttle = 0
+		self.cc = congestion(self)
+		self.cnt_send = 0			# ͵ݶش
+		self.cnt_resend = 0			# ʱشĶ
+		self.cnt_fast = 0			# شĶ
+		self.cnt_probe = 0			# 㴰̽ⷢ͵Ķ
+		self.cnt_ack = 0			# ͵ȷ϶
+		self.sack = False			# Զ֧ SEG_SACKյ
+		self.sack_ranges = SACK_RANGES
+		self.fastresend = FAST_RESEND
+		self.rmt_limit = None		# Զ˴͵ţNoneΪ
+		self.rcv_adv = self.rcv_wnd	# һͨĽմ
+		self.rcv_right = self.rcv_wnd	# ͨĴұ߽磺
+		self.wnd_update = False		# մ´򿪣ҪͨԶ
+
+	# ѡӵ㷨CONGESTIONе
+	def setcc (self, name):
+		if not name in CONGESTION:
+			raise Exception('unknown congestion control: %s'%name)
+		self.cc = CONGESTION[name](self)
+		return 0
 
 	def send (self, data):
 		self.sendque.append(data)
@@ -86,7 +308,15 @@ class reliable(object):
 	def recv (self):
 		if len(self.recvque) == 0:
 			return None
-		return self.recvque.popleft()
+		data = self.recvque.popleft()
+		if self.sack and self.rcv_adv * 2 < self.rcv_wnd:
+			if self._window() * 2 >= self.rcv_wnd:	# ´һ
+				self.wnd_update = True
+		return data
+
+	# մڣܽնٸΣrecvqueûȡߵҲռôڣ
+	def _window (self):
+		return max(0, self.rcv_wnd - len(self.recvque))
 	
 	# ⲿʵ
 	def output (self, data):
@@ -122,25 +352,82 @@ class reliable(object):
 				self._parse_dat(seg)		# 
 			elif seg.cmd == SEG_ACK:
 				self._parse_ack(seg)		# Ӧ
+			elif seg.cmd == SEG_SACK:
+				if self.sack_ranges > 0:
+					self.sack = True
+					self._parse_sack(seg)	# ۻѡȷ
 		return retval
 
-	# 棺ͻпԷ͵outputȥ
+	#  SEG_SACKseqΪ rcv_nxt֮ǰĶյˣtsΪյ
+	# εʱΪմڡöεԼ rcv_bufյ
+	# [, ֹ)Զ˻֪Ƿ֧ʱݷһŵ
+	# SEG_SACKΪͨ棬ֻͨ洰ʱҲ
+	def _make_sack (self, echo = None):
+		ts = 0
+		self.rcv_adv = self._window()
+		self.rcv_right = max(self.rcv_right, self.rcv_nxt + self.rcv_adv)
+		data = struct.pack('!L', self.rcv_adv)
+		if echo is not None:
+			ts = echo[1]
+			data += struct.pack('!L', echo[0])
+			ranges = []
+			for seq in sorted(self.rcv_buf):
+				if ranges and ranges[-1][1] == seq:
+					ranges[-1][1] = seq + 1
+				elif len(ranges) < self.sack_ranges:
+					ranges.append([seq, seq + 1])
+				else:
+					break
+			for start, end in ranges:
+				data += struct.pack('!LL', start, end)
+		seg = segment(self.conv, SEG_SACK, self.rcv_nxt, ts, data)
+		return seg.marshal()
+
+	# Է͵ݶԶ˴ڹرղûδȷϵĶʱ
+	# һΪ㴰̽⣬ʱشӱֱԶ˴ڴ
+	def _sendable (self):
+		if len(self.sendque) == 0 or self.throttle:
+			return 0
+		limit = self.snd_una + self.snd_wnd - self.snd_nxt
+		if self.rmt_limit is not None:
+			limit = min(limit, self.rmt_limit - self.snd_nxt)
+			if limit <= 0 and not self.snd_buf:
+				return 1
+		limit = min(limit, self.cc.window() - len(self.snd_buf))
+		return min(limit, len(self.sendque))
+
+	# 棺ͻпԷ͵outputȥشֻ
+	# snd_timerеڵĶΣûӦݼشʱֱӷ
 	def flush (self):
 		current = self.current
 		timestamp = self.timestamp
+		if not self.ack_lst and not self.wnd_update and self._sendable() <= 0:
+			deadline = self.snd_timer.deadline()
+			if deadline is None or deadline > current:
+				return 0
 		text = ''
-		self.ack_lst.sort()							# Ӧ
-		for seq, ts in self.ack_lst:
-			seg = segment(self.conv, SEG_ACK, seq, ts)
-			data = seg.marshal()
+		if (self.ack_lst or self.wnd_update) and self.sack:
+			echo = self.ack_lst and self.ack_lst[-1] or None
+			data = self._make_sack(echo)			# һ SEG_SACKȷȫ
 			text += struct.pack('!H', len(data)) + data
-			if len(text) + 16 >= self.mss:
-				self.output('CNET' + text)
-				text = ''
+			self.cnt_ack += 1
+		elif self.ack_lst:
+			self.ack_lst.sort()						# Ӧ
+			for seq, ts in self.ack_lst:
+				seg = segment(self.conv, SEG_ACK, seq, ts)
+				data = seg.marshal()
+				text += struct.pack('!H', len(data)) + data
+				self.cnt_ack += 1
+				if len(text) + 16 >= self.mss:
+					self.output('CNET' + text)
+					text = ''
 		self.ack_lst = []
-		while self.snd_nxt < self.snd_una + self.snd_wnd:	# ݵ
-			if len(self.sendque) == 0:
-				break
+		self.wnd_update = False
+		queue = []
+		for seq in self.snd_timer.expire(current):	# ڵش
+			queue.append((seq, self.snd_buf[seq]))
+		queue.sort()
+		for i in xrange(self._sendable()):			# ݵ
 			data = self.sendque.popleft()
 			seg = segment(self.conv, SEG_DAT, self.snd_nxt, 0, data)
 			seg.ts_resend = current					# µ segment
@@ -148,18 +435,43 @@ class reliable(object):
 			seg.data = data
 			seg.xmit = 0
 			seg.enlarge = 1.0
+			seg.ts_lost = -1						# һγʱشʱ
+			seg.sent = 0							# һη͵
+			seg.fastack = 0							# ֮͵ĶαȷϵĴ
+			seg.fast = False
 			self.snd_buf[self.snd_nxt] = seg
+			queue.append((self.snd_nxt, seg))
 			self.snd_nxt += 1						# к
-		queue = []
-		for seq in self.snd_buf:
-			seg = self.snd_buf[seq]
-			if current >= seg.ts_resend:
-				queue.append((seq, seg))
-		queue.sort()
+		if queue and not self.sack and self.sack_ranges > 0:
+			data = self._make_sack()				# ֧ͨ SEG_SACK
+			text += struct.pack('!H', len(data)) + data
 		for seq, seg in queue:						# װ
+			probe = self.rmt_limit is not None and seq >= self.rmt_limit
+			if probe:								# 㴰̽⣺ش
+				self.cnt_probe += 1
+				if seg.xmit > 0:
+					seg.enlarge *= 2.0
+				seg.xmit = 0
+			elif seg.xmit > 0:						# ʱش
+				if seg.ts_lost < 0:
+					seg.ts_lost = timestamp
+				self.cc.lost(seq)
+				if seg.fast:
+					self.cnt_fast += 1
+				else:
+					self.cnt_resend += 1
+					seg.enlarge *= 1.2
+			self.cnt_send += 1
+			seg.sent = self.cnt_send
+			self.snd_order.pop(seq, None)
+			self.snd_order[seq] = seg
+			seg.fastack = 0
+			seg.fast = False
 			seg.ts = timestamp
 			seg.ts_resend = current + seg.enlarge * self.rx_rto * 0.001
-			seg.enlarge *= 1.2
+			if probe:
+				seg.ts_resend = min(seg.ts_resend, current + WND_PROBE)
+			self.snd_timer.schedule(seq, seg.ts_resend)
 			seg.xmit += 1
 			if seg.xmit >= 10:
 				self.state = -1
@@ -181,6 +493,8 @@ class reliable(object):
 		current = self.current
 		timestamp = self.timestamp
 		self.ack_lst.append((seg.seq, seg.ts))
+		if self.sack and seg.seq >= self.rcv_right:
+			return -1						# ͨĴڣֻӦ
 		if (not seg.seq in self.rcv_buf) and (seg.seq >= self.rcv_nxt):
 			self.rcv_buf[seg.seq] = seg
 		while True:							# ׼õƶrecvque
@@ -193,12 +507,12 @@ class reliable(object):
 			self.rcv_nxt += 1
 		return 0
 	
-	# 룺 SEG_ACK
-	def _parse_ack (self, seg):
-		current = self.current
+	#  rtt rtotsΪȷдصʱ rtt룩
+	def _update_rtt (self, ts):
 		timestamp = self.timestamp
-		if seg.ts < timestamp:				# ³ʱ
-			rtt = timestamp - seg.ts
+		rtt = -1
+		if ts < timestamp:					# ³ʱ
+			rtt = timestamp - ts
 			if self.rx_srtt == 0:
 				self.rx_srtt = rtt
 				self.rx_rttval = rtt / 2
@@ -207,19 +521,112 @@ class reliable(object):
 				if delta < 0: delta = -delta
 				self.rx_rttval = (3 * self.rx_rttval + delta) / 4
 				self.rx_srtt = (7 * self.rx_srtt + rtt) / 8
-			rto = self.rx_srtt + max(1, 2 * self.rx_rttval)
+			rto = self.rx_srtt + max(self.rx_minrto, 4 * self.rx_rttval)
 			if rto > 10000: rto = 10000
 			if rto <= 1: rto = 1
 			self.rx_rto = rto
 			#print 'rtt=%d rto=%d'%(rtt, rto)
-		if not seg.seq in self.snd_buf:
-			return 0
-		del self.snd_buf[seg.seq]			# ·ͻ
-		while self.snd_una <= self.snd_nxt:
+		return rtt
+
+	# ʱĶΣȷϵǳʱشǰһʱ
+	def _check_echo (self, seq, ts):
+		seg = self.snd_buf.get(seq)
+		if seg is not None and ts < seg.ts_lost:
+			self.cc.spurious(seq)
+		return 0
+
+	# ӷͻɾȷϵĶΣ snd_unaʱشԺ󲻵
+	#  rttյȷϵģȷϵֻ֮ǰһݣشǶ
+	def _acked (self, seqs, rtt):
+		limit = self.timestamp - self.rx_srtt / 2
+		sent = []
+		for seq in seqs:
+			seg = self.snd_buf.pop(seq, None)
+			if seg is None:
+				continue
+			self.snd_timer.cancel(seq)
+			del self.snd_order[seq]
+			if seg.ts_lost >= 0 and seg.ts_lost > limit:
+				self.cc.spurious(seq)
+			self.cc.acked(rtt)
+			if seg.xmit == 1:		# شĶβ֪ȷϵһ
+				sent.append(seg.sent)
+		if sent and self.fastresend > 0:
+			self._fast_check(sent)
+		while self.snd_una < self.snd_nxt:
 			if self.snd_una in self.snd_buf:
 				break
 			self.snd_una += 1
 		return 0
+
+	# ش󷢳ĶѾ fastresendȷ˻ûȷ
+	# ĶΣΪѾʧȳʱشsentΪȷϵĸ
+	# һη͵š緢δȷ϶οʼ˳飬
+	# ȷϵ󷢳ĶΪֹ
+	def _fast_check (self, sent):
+		current = self.current
+		sent.sort()
+		last = sent[-1]
+		count = len(sent)
+		index = 0
+		for seq, seg in self.snd_order.iteritems():
+			if seg.sent >= last:
+				break
+			if seg.fast:
+				continue
+			while sent[index] < seg.sent:	# 󷢳 count - index
+				index += 1
+			seg.fastack += count - index
+			if seg.fastack >= self.fastresend:
+				seg.fast = True
+				seg.ts_resend = current
+				self.snd_timer.schedule(seq, current)
+		return 0
+
+	# Զ˴ڣlimitΪ͵šڴʱ֮ǰΪ̽
+	# Ķش
+	def _remote_window (self, limit):
+		prev = self.rmt_limit
+		self.rmt_limit = limit
+		if prev is None or limit <= prev:
+			return 0
+		for seq in xrange(max(prev, self.snd_una), min(limit, self.snd_nxt)):
+			seg = self.snd_buf.get(seq)
+			if seg is not None:
+				seg.enlarge = 1.0
+				self.snd_timer.schedule(seq, self.current)
+		return 0
+
+	# 룺 SEG_ACK
+	def _parse_ack (self, seg):
+		rtt = self._update_rtt(seg.ts)
+		if not seg.seq in self.snd_buf:
+			return 0
+		self._check_echo(seg.seq, seg.ts)
+		self._acked((seg.seq,), rtt)
+		return 0
+
+	# 룺 SEG_SACKۻȷ seq֮ǰжΣ
+	# Լеÿ
+	def _parse_sack (self, seg):
+		data = seg.data
+		if len(data) >= 4:
+			self._remote_window(seg.seq + struct.unpack('!L', data[:4])[0])
+		if len(data) < 8:					# ֻͨ棬ȷ
+			rtt = -1
+		else:
+			rtt = self._update_rtt(seg.ts)
+			self._check_echo(struct.unpack('!L', data[4:8])[0], seg.ts)
+		una = min(seg.seq, self.snd_nxt)
+		seqs = range(self.snd_una, una)
+		for pos in xrange(8, len(data) - 7, 8):
+			start, end = struct.unpack('!LL', data[pos:pos + 8])
+			start = max(start, una)
+			end = min(end, self.snd_nxt)
+			if end - start > 0:
+				seqs.extend(xrange(start, end))
+		self._acked(seqs, rtt)
+		return 0
 	
 	def log (self, *args):
 		head = time.strftime('%H:%M:%S', time.localtime())
@@ -227,6 +634,15 @@ class reliable(object):
 		text = '[%s] [%d] %s'%(head, self.id, tail)
 		#print text
 
+	# һҪ updateʱ䣺ҪʱΪǰʱ䣬Ϊ
+	# شʱ䣬ûκζʱʱ None
+	def deadline (self):
+		if len(self.ack_lst) > 0 or self.wnd_update:
+			return self.current
+		if self._sendable() > 0:
+			return self.current
+		return self.snd_timer.deadline()
+
 	# ʱ
 	def update (self, current = -1):
 		if current < 0:
@@ -242,13 +658,16 @@ class reliable(object):
 # simulator - ģ
 #----------------------------------------------------------------------
 class simpipe(object):
-	def __init__ (self, rtt = 0.2, lost = 0.1, amb = 0.5, limit = 100):
+	def __init__ (self, rtt = 0.2, lost = 0.1, amb = 0.5, limit = 100, \
+			rate = 0):
 		self.pipe = []
 		self.limit = limit
 		self.rtt = rtt * 0.5
 		self.lost = lost
 		self.amb = amb
 		self.wave = self.rtt * self.amb
+		self.rate = rate		# ƿÿ0Ϊ
+		self.busy = 0			# ƿſյʱ
 	def put (self, data):	# ݲһӳ
 		current = time.time()
 		import random
@@ -256,7 +675,13 @@ class simpipe(object):
 			return 1
 		wave = self.rtt + self.wave * (2 * random.random() - 1)
 		future = wave < 0.0 and current or (current + wave)
-		if len(self.pipe) >= self.limit:
+		if self.rate > 0:	# ƿŶ limit϶
+			busy = max(self.busy, current)
+			if (busy - current) * self.rate >= self.limit:
+				return -1
+			self.busy = busy + 1.0 / self.rate
+			future += self.busy - current
+		elif len(self.pipe) >= self.limit:
 			return -1
 		self.pipe.append((future, str(data)))
 		self.pipe.sort()
@@ -283,9 +708,9 @@ class simnet(object):
 			return ''
 		return data
 
-def simulator(rtt = 0.2, lost = 0.1, amb = 0.5, limit = 100):
-	pipe1 = simpipe(rtt, lost, amb, limit)
-	pipe2 = simpipe(rtt, lost, amb, limit)
+def simulator(rtt = 0.2, lost = 0.1, amb = 0.5, limit = 100, rate = 0):
+	pipe1 = simpipe(rtt, lost, amb, limit, rate)
+	pipe2 = simpipe(rtt, lost, amb, limit, rate)
 	p1 = simnet(pipe1, pipe2)
 	p2 = simnet(pipe2, pipe1)
 	return p1, p2
@@ -352,7 +777,173 @@ if __name__ == '__main__':
 				record = data.split(' ')
 				ts = time.time() - float(record[1])
 				print '[RECV]', record[0], ts
-	test2()
+	def test3(name = 'reno', seconds = 20, rate = 300):
+		# һƿrate/룬Ŷ 50ڶ
+		# Ƚϸ㷨¡شεĹƽԣJainָ
+		shared = simpipe(0.1, 0, 0.1, 50, rate)
+		empty = simpipe()
+		senders, receivers, got = [], [], []
+		for i in xrange(2):
+			back = simpipe(0.1, 0, 0.1, 100000)
+			n1 = netreliable(i + 1, network = simnet(back, shared), id = i)
+			n2 = netreliable(i + 1, network = simnet(empty, back), id = i)
+			n1.setcc(name)
+			senders.append(n1)
+			receivers.append(n2)
+			got.append([0, 0])
+		start = time.time()
+		half = start + seconds * 0.5
+		while time.time() < start + seconds:
+			time.sleep(0.001)
+			current = time.time()
+			for i in xrange(2):
+				n1 = senders[i]
+				if i == 1 and current < start + seconds * 0.25:
+					continue
+				while len(n1.sendque) < 64:
+					n1.send('x' * 1000)
+				n1.update2()
+			while 1:
+				data = shared.get()
+				if data is None: break
+				conv = struct.unpack('!L', data[6:10])[0]
+				receivers[conv - 1].input(data)
+			for i in xrange(2):
+				receivers[i].update2()
+				while receivers[i].recv() is not None:
+					got[i][0] += 1
+					if current >= half:
+						got[i][1] += 1
+		late = [ float(n[1]) for n in got ]
+		jain = sum(late) ** 2 / (2 * sum([ n * n for n in late ]) or 1)
+		for i in xrange(2):
+			print '%s flow%d: got %d (%.1f pkt/s) send %d resend %d'%(name, \
+				i, got[i][0], got[i][0] / float(seconds), \
+				senders[i].cnt_send, senders[i].cnt_resend)
+		print '%s: utilization %.2f fairness %.3f'%(name, \
+			sum(late) / (seconds * 0.5 * rate), jain)
+	def test4(lost = 0.05, count = 2000):
+		# ж·Ϸ countȽȷ SEG_SACKķ
+		# ȷ϶Լش
+		for ranges in (0, SACK_RANGES):
+			p1, p2 = simulator(0.1, lost, 0.2, 100000)
+			n1 = netreliable(1, network = p1)
+			n2 = netreliable(1, network = p2)
+			n1.sack_ranges = n2.sack_ranges = ranges
+			n1.setcc('reno')
+			packets = [0]
+			def output(data, network = p2):
+				packets[0] += 1
+				network.send(data)
+			n2.output = output
+			got, index = 0, 0
+			start = time.time()
+			while got < count:
+				time.sleep(0.001)
+				while index < count and len(n1.sendque) < 64:
+					n1.send('x' * 1000)
+					index += 1
+				n1.update2()
+				n2.update2()
+				while n2.recv() is not None:
+					got += 1
+			print 'sack=%d: %.2fs reverse packets %d acks %d resend %d '\
+				'fast %d'%(ranges, time.time() - start, packets[0], \
+				n2.cnt_ack, n1.cnt_resend, n1.cnt_fast)
+	def test5(lost = 0.03, seconds = 20):
+		# ж·ÿ 2msһϢȽϲʹʹÿشʱ
+		# Ϣӳ٣λ99%
+		for fast in (0, FAST_RESEND):
+			p1, p2 = simulator(0.1, lost, 0.05, 100000)
+			n1 = netreliable(1, network = p1)
+			n2 = netreliable(1, network = p2)
+			n1.fastresend = fast
+			delay = []
+			start = time.time()
+			slap = start
+			while time.time() < start + seconds:
+				time.sleep(0.001)
+				current = time.time()
+				if current >= slap:
+					slap += 0.002
+					n1.send('%.6f'%current)
+				n1.update2()
+				n2.update2()
+				while 1:
+					data = n2.recv()
+					if data is None: break
+					delay.append(time.time() - float(data))
+			delay.sort()
+			size = len(delay)
+			print 'fast=%d: got %d median %.3f p99 %.3f max %.3f '\
+				'resend %d fast %d'%(fast, size, delay[size / 2], \
+				delay[size * 99 / 100], delay[-1], n1.cnt_resend, \
+				n1.cnt_fast)
+	def test6(times = 2000):
+		# ʹڵȴȷϣʱÿ updateĺʱ
+		for window in (64, 256, 1024):
+			n1 = reliable(1, current = 1.0)
+			n1.snd_wnd = window
+			n1.setcc('none')
+			for i in xrange(window + 100):
+				n1.send('x' * 100)
+			n1.update(1.0)
+			t = time.time()
+			for i in xrange(times):
+				n1.update(1.0 + i * 0.00001)
+			t = time.time() - t
+			print 'window %d: %.2f us per update'%(window, t * 1000000 / times)
+		# һζʧ֮Ķȷʱÿȷϵĺʱ
+		for window in (64, 256, 1024, 4096):
+			n1 = reliable(1, current = 1.0)
+			n1.snd_wnd = window
+			n1.setcc('none')
+			for i in xrange(window):
+				n1.send('x' * 100)
+			n1.update(1.0)
+			t = time.time()
+			for seq in xrange(1, window):
+				n1._acked((seq,), -1)
+			t = time.time() - t
+			print 'window %d: %.2f us per ack (fast %d)'%(window, \
+				t * 1000000 / (window - 1), n1.snd_buf[0].fast)
+	def test7(count = 3000, stall = 3.0):
+		# շֹͣȡ stall룬֮ٶȡջӦò
+		# rcv_wndͷ㴰̽Ͽ
+		p1, p2 = simulator(0.1, 0.02, 0.1, 100000)
+		n1 = netreliable(1, network = p1)
+		n2 = netreliable(1, network = p2)
+		for i in xrange(count):
+			n1.send('m%d'%i)
+		got, peak = 0, 0
+		start = time.time()
+		while got < count and n1.state >= 0:
+			time.sleep(0.001)
+			n1.update2()
+			n2.update2()
+			peak = max(peak, len(n2.recvque) + len(n2.rcv_buf))
+			if time.time() < start + stall:
+				continue
+			for i in xrange(2):
+				data = n2.recv()
+				if data is None: break
+				assert data == 'm%d'%got
+				got += 1
+		print 'got %d in %.2fs peak buffer %d probe %d state %d'%(got, \
+			time.time() - start, peak, n1.cnt_probe, n1.state)
+	if len(sys.argv) > 1 and sys.argv[1] == 'window':
+		test7()
+	elif len(sys.argv) > 1 and sys.argv[1] == 'update':
+		test6()
+	elif len(sys.argv) > 1 and sys.argv[1] == 'sack':
+		test4()
+	elif len(sys.argv) > 1 and sys.argv[1] == 'fast':
+		test5()
+	elif len(sys.argv) > 1:
+		for name in sys.argv[1:]:
+			test3(name)
+	else:
+		test2()
 	
 
 	
\ No newline at end of file
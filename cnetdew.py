@@ -31,6 +31,7 @@ class nprotocol(cnetdat.reliable):
 		self.connection = connection
 		super(nprotocol, self).__init__ (connection.conv, 1400, \
 			connection.current, connection.sport)
+		self.setcc(connection.host.cc)
 	def output (self, data):
 		if self.connection != None:
 			self.connection.send(CMD_DATA, data)
@@ -83,6 +84,7 @@ class connection(object):
 		self.route = None				# ·Ϣ
 		self.dstaddr = None				# Զ˵ַ(ip, port)
 		self.dstmode = 0				# Զ˷ͷʽǷת
+		self.follow = None				# ӷͨ·յİ
 		self.head = cnetcom.msghead()
 		self.head.suid = self.host.uid
 		self.head.skey = self.host.key
@@ -142,6 +144,15 @@ class connection(object):
 	
 	def __len__ (self):
 		return len(self.recvque)
+
+	# һҪ updateʱ䣺ʱԼ²Эشʱ
+	def deadline (self):
+		deadline = self.time_plus
+		if self.establish == 1:
+			t = self.protocol.deadline()
+			if t is not None and t < deadline:
+				deadline = t
+		return deadline
 	
 	def log (self, *args):
 		self.host.log('[%d]'%self.sport, *args)
@@ -192,13 +203,15 @@ class connection(object):
 	def _try_working (self):
 		if self.current >= self.time_plus:
 			self.time_plus = self.current + 1.0
+			if self.type == TYPE_CONNECTOR:		# ·ɣͨ·̽
+				self.host.active(self.duid, self.dkey)
 			if self.current >= self.time_alive + TIME_KEEPALIVE:
 				self.send(CMD_ALIVE, '%s'%self.current)
 			if self.current >= self.time_alive + TIME_KEEPALIVE + 15.0:
 				self.log('_try_working: keepalive out of time')
 				self._do_disconnect()
 		self.protocol.update(self.current)
-		while True:
+		while len(self.recvque) < self.limit:	# ԺɽմƶԶ
 			data = self.protocol.recv()
 			if data == None:
 				break
@@ -207,6 +220,39 @@ class connection(object):
 				self.recvque.append((channel, data[2:]))
 		return 0
 	
+	# ӷǨͨ·routeΪ routingл best
+	def migrate (self, route):
+		if self.type != TYPE_CONNECTOR or self.establish != 1:
+			return -1
+		if (route[3], route[4]) == (self.dstaddr, self.dstmode):
+			return 0
+		self.route = route
+		self.dstaddr = route[3]
+		self.dstmode = route[4]
+		self.log('migrate: %s %d'%(cnetudp.ep2text(route[3]), route[4]))
+		return 0
+
+	# ӷͨ· PATH_CONFIRMͬһͨ·յʱ
+	# ˵ӷѾǨƹȥˣظҲͨ·
+	def _follow (self, remote, forward):
+		if self.type != TYPE_LISTENER or self.establish != 1:
+			return 0
+		if remote == self.dstaddr and forward == self.dstmode:
+			self.follow = None
+			return 0
+		path = (remote, forward)
+		if self.follow is None or self.follow[0] != path:
+			self.follow = [path, 0]
+		self.follow[1] += 1
+		if self.follow[1] < cnetcom.PATH_CONFIRM:
+			return 0
+		self.follow = None
+		self.route = (self.route[0], remote, forward) + self.route[3:]
+		self.dstaddr = remote
+		self.dstmode = forward
+		self.log('follow: %s %d'%(cnetudp.ep2text(remote), forward))
+		return 1
+
 	# 
 	def _recv_data (self, data):
 		if data[:4] == 'CNET':
@@ -218,7 +264,8 @@ class connection(object):
 				if seq >= self.rcv_seq or channel >= 8:
 					if channel < 8:
 						self.rcv_seq = seq + 1
-					self.recvque.append((channel, data[10:]))
+					if len(self.recvque) < self.limit:	# ˶
+						self.recvque.append((channel, data[10:]))
 		return 0
 	
 	# 
@@ -362,11 +409,17 @@ class hostnet(cnetcom.hostbase):
 		self.accepted = []
 		self.events = collections.deque()
 		self.canlog = 0
+		self.throttle = 0
+		self.cc = 'reno'				# ӵӵ㷨
+		self.register(CMD_SYN1, self._recv_syn1)
+		self.register(CMD_SACK1, self._recv_sack1)
+		for cmd in xrange(CMD_SYN2, CMD_FACK2 + 1):	# ѽ˿ϵϢ
+			self.register(cmd, self._port_dispatch)
 	
 	# ӿڣʼ
-	def init (self, uid, passwd, port = 0, server = None):
+	def init (self, uid, passwd, port = 0, server = None, batch = 0):
 		self.quit()
-		super (hostnet, self).init(uid, passwd, port, server)
+		super (hostnet, self).init(uid, passwd, port, server, batch)
 		self.log('[CNET] init(%d, %d, %d)'%(uid, passwd, port))
 
 	# ӿڣ˳
@@ -417,6 +470,7 @@ class hostnet(cnetcom.hostbase):
 		if conn.establish != 1:
 			return -2
 		conn.senddat(channel, data)
+		self.timers.schedule(('port', port), self.current)
 		return 0
 
 	# ӿڣϢ
@@ -427,6 +481,8 @@ class hostnet(cnetcom.hostbase):
 		channel, data = conn.recvdat()
 		if channel < 0:
 			return RECV_BLOCKING, ''
+		if len(conn.protocol.recvque) > 0:	# ȡѹݣ򿪽մ
+			self.timers.schedule(('port', port), self.current)
 		return channel, data
 	
 	# ӿڣ״̬
@@ -447,6 +503,15 @@ class hostnet(cnetcom.hostbase):
 		conn = self.ports[port]
 		return conn.route
 	
+	# ӿڣӵӵ㷨cnetdat.CONGESTIONе
+	def setcc (self, port, name):
+		if not port in self.ports:
+			return -1
+		if not name in cnetdat.CONGESTION:
+			return -2
+		self.ports[port].protocol.setcc(name)
+		return 0
+
 	# ӿڣȡʱ RTT
 	def getrtt (self, port):
 		if not port in self.ports:
@@ -471,6 +536,7 @@ class hostnet(cnetcom.hostbase):
 				break
 		conn = connection(mode, self, port, duid, dkey, conv, linkdesc)
 		self.ports[port] = conn
+		self.timers.schedule(('port', port), self.current)
 		self.log('port_open', port)
 		return port
 
@@ -487,9 +553,18 @@ class hostnet(cnetcom.hostbase):
 		conn.close()
 		conn = None
 		del self.ports[port]
+		self.timers.cancel(('port', port))
 		self.log('port_close', port, reason)
 		return 0
 	
+	# ·лͨ·ǨƵöԶ˵ѽ
+	def _route_migrate (self, ident, route):
+		super (hostnet, self)._route_migrate(ident, route)
+		for port, conn in self.ports.items():
+			if (conn.duid, conn.dkey) == ident:
+				conn.migrate(route.best)
+		return 0
+
 	# ˿ڽ
 	def _port_establish (self, port):
 		if not port in self.ports:
@@ -584,6 +659,7 @@ class hostnet(cnetcom.hostbase):
 			self.sendudp(msghead, '', remote, forward)
 			return -3
 		conn._recv_sack1(port)
+		self.timers.schedule(('port', sport), self.current)
 		return 0
 
 	# յ syn2Ϣ
@@ -610,36 +686,39 @@ class hostnet(cnetcom.hostbase):
 			msghead = cnetcom.msghead(self.uid, self.key, \
 				head.suid, head.skey, CMD_NOCONV, head.conv)
 			self.sendudp(msghead, '', remote, forward)
+		else:
+			conn._follow(remote, forward)
 		conn.input(head, data)
+		self.timers.schedule(('port', port), self.current)
 		return 0
 	
-	# ˿ڸ
-	def _port_update (self):
-		for port, conn in self.ports.items():
+	# ˿ڸ£ֻ¶ʱڣյݡҪͣĶ˿ڣ
+	# º connection.deadlineµǼǡӵʱͣµĿɿ
+	# ݣӦճͣӵ״̬仯ʱж˿ڶҪһ
+	def _port_update (self, fired):
+		throttle = self.network.congested() and 1 or 0
+		if throttle != self.throttle:
+			self.throttle = throttle
+			fired = [ ('port', port) for port in self.ports ]
+		for kind, port in fired:
+			if kind != 'port' or not port in self.ports:
+				continue
+			conn = self.ports[port]
+			conn.protocol.throttle = throttle
 			conn.update(self.current)
-			if len(conn) >= conn.limit:		# Ϣ
+			if len(conn.protocol.recvque) >= conn.limit:	# Զ˲ᴰ
 				self.log('buffer limit reached')
 				conn._do_disconnect()
 			if not conn.isalive():			# ǷѾϿ
 				self.log('not isalive')
 				self._port_close(conn.sport, 'not alive')
+				continue
+			self.timers.schedule(('port', port), conn.deadline())
 		return 0
 
-	# Ϣ
-	def _process (self, head, data, remote, forward):
-		cmd = head.cmd
-		if cmd == CMD_SYN1:
-			self._recv_syn1(head, data, remote, forward)
-		elif cmd == CMD_SACK1:
-			self._recv_sack1(head, data, remote, forward)
-		elif (cmd >= CMD_SYN2) and (cmd <= CMD_FACK2):
-			self._port_dispatch(head, data, remote, forward)
-		return 0
-
-	# 
-	def update (self):
-		super (hostnet, self).update()
-		self._port_update()
+	# ʱ hostbase.updateУ֮ǰ
+	def _tick (self, fired):
+		return self._port_update(fired)
 
 
 
@@ -655,8 +734,8 @@ class hostwan(object):
 		self.key = -1
 	
 	# ӿڣʼ
-	def init (self, uid, passwd, portudp = 0, server = None):
-		self.host.init(uid, passwd, portudp, server)
+	def init (self, uid, passwd, portudp = 0, server = None, batch = 0):
+		self.host.init(uid, passwd, portudp, server, batch)
 		self.uid = uid
 		self.key = passwd
 	
@@ -723,6 +802,25 @@ class hostwan(object):
 		self.host.update()
 		self.current = time.time()
 
+	# ӿڣȡ׽֣ cnetudp.waitfor
+	def fileno (self):
+		return self.host.fileno()
+
+	# ӿڣһҪ updateʱ
+	def deadline (self):
+		return self.host.deadline()
+
+	# ӿڣȴֱݻ߶ʱڣȻ
+	def wait (self, timeout = None):
+		cnetudp.waitfor([ self ], timeout)
+		self.update()
+
+	# ӿڣ¼ѭֱر
+	def run (self):
+		while self.host.network.sock:
+			self.wait()
+		return 0
+
 
 #----------------------------------------------------------------------
 # testing case
@@ -787,7 +885,7 @@ if __name__ == '__main__':
 
 		index = 0
 		while 1:
-			time.sleep(0.005)
+			cnetudp.waitfor([ host1, host2 ], time_slap - time.time())
 			host1.update()
 			host2.update()
 			#print '.'
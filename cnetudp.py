@@ -12,24 +12,31 @@ import sys
 import time
 import socket
 import struct
+import array
 import errno
+import select
+import heapq
+import bisect
+import math
 import collections
 
 
 #----------------------------------------------------------------------
-# ȡñַб
+# ȡñַб SIOCGIFCONFȡַstruct
+# ifreq 64λϵͳΪ 40ֽڣʧʱŽ
 #----------------------------------------------------------------------
 def hostaddr(hostc = ''):
 	table, result = [], []
 	try:
 		import fcntl
 		s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-		total = 32 * 128
+		step = (struct.calcsize('P') == 8) and 40 or 32
+		total = step * 128
 		bytes = array.array('B', '\0' * total)
 		point = struct.pack('iL', total, bytes.buffer_info()[0])
 		size = struct.unpack('iL', fcntl.ioctl(s.fileno(), 0x8912, point))[0]
-		result = [ bytes[i:i+32].tostring() for i in range(0, size, 32) ]
-		table = [ '.'.join(['%d'%ord(v) for v in n[-12:-8]]) for n in result]
+		ifreq = [ bytes[i:i+step].tostring() for i in range(0, size, step) ]
+		table = [ socket.inet_ntoa(n[20:24]) for n in ifreq ]
 		s.close()
 	except: table = socket.gethostbyname_ex(socket.gethostname())[2]
 	f = lambda a: socket.inet_aton(a)
@@ -51,6 +58,102 @@ def hostaddr(hostc = ''):
 	return result
 
 
+#----------------------------------------------------------------------
+# addrwatch - ַ棺ֻڵַܱ仯ʱŵ hostaddrLinux
+#  netlinkRTMGRP_LINK | RTMGRP_IPV4_IFADDRں˵ĵַ仯֪ͨ
+# ϵͳ netlinkʱˢ¡ַб仯ʱ versionһ
+#----------------------------------------------------------------------
+class addrwatch(object):
+
+	# ʼperiodΪ netlinkʱĶˢڣfallbackΪû
+	# netlinkʱˢ
+	def __init__ (self, period = 60, fallback = 30):
+		self.addr = []
+		self.version = 0
+		self.period = period
+		self.fallback = fallback
+		self.time = -1
+		self.dirty = True
+		self.netlink = None
+		self.__netlink_open()
+
+	#  netlink׽֣ʧʱʹöˢ
+	def __netlink_open (self):
+		family = getattr(socket, 'AF_NETLINK', None)
+		if family is None:
+			return -1
+		try:
+			sock = socket.socket(family, socket.SOCK_RAW, 0)
+			sock.bind((0, 0x01 | 0x10))
+			sock.setblocking(0)
+		except:
+			return -2
+		self.netlink = sock
+		return 0
+
+	#  netlink֪֪ͨͨʱ Trueݣȡַ
+	def __netlink_read (self):
+		changed = False
+		while self.netlink:
+			try:
+				data = self.netlink.recv(0x10000)
+			except socket.error, (code, strerror):
+				if code == errno.ENOBUFS:	# ֪ͨͬҪˢ
+					changed = True
+					continue
+				if not code in (errno.EAGAIN, errno.EWOULDBLOCK):
+					self.close()
+				break
+			if not data:
+				break
+			changed = True
+		return changed
+
+	# ر netlink
+	def close (self):
+		if self.netlink:
+			try: self.netlink.close()
+			except: pass
+			self.netlink = None
+		return 0
+
+	# ȡ netlink׽֣ûʱ -1
+	def fileno (self):
+		if not self.netlink:
+			return -1
+		return self.netlink.fileno()
+
+	# ַ仯Ҫʱȡõַбб仯ʱ 1
+	def check (self, current = -1):
+		if current < 0:
+			current = time.time()
+		if self.netlink and self.__netlink_read():
+			self.dirty = True
+		if current >= self.time:
+			self.dirty = True
+		if not self.dirty:
+			return 0
+		self.dirty = False
+		period = self.netlink and self.period or self.fallback
+		self.time = current + period
+		addr = hostaddr()
+		if addr == self.addr:
+			return 0
+		self.addr = addr
+		self.version += 1
+		return 1
+
+
+# ڹĵַ
+_addrwatch = None
+
+def addrwatch_shared():
+	global _addrwatch
+	if _addrwatch is None:
+		_addrwatch = addrwatch()
+	return _addrwatch
+
+
 __savetime = time.time()
 
 def _millisec():
@@ -83,6 +186,18 @@ def sockaddr(ep):
 	data += '\x00\x00\x00\x00\x00\x00\x00\x00'
 	return data
 
+# ݳȣdataǷֶε tuple
+def _buflen(data):
+	if type(data) is not tuple:
+		return len(data)
+	size = 0
+	for part in data:
+		size += len(part)
+	return size
+
+# תͷITMU_FORWARD, 0x8000, ipֽ, 0, port
+_forward_struct = struct.Struct('<HH4sLL')
+
 
 #----------------------------------------------------------------------
 # ӡ
@@ -108,6 +223,164 @@ def print_binary(data, char = False):
 	return 0
 
 
+#----------------------------------------------------------------------
+# udpbatch - շLinux  recvmmsg/sendmmsg һϵͳշ
+# ݱƽ̨ availableΪ FalseӦ˻շ
+#----------------------------------------------------------------------
+class udpbatch(object):
+
+	# ʼcountΪÿϵͳദİsizeΪ
+	def __init__ (self, count = 32, size = 0x10000):
+		self.count = count
+		self.size = size
+		self.available = False
+		self.names = {}
+		self.addrs = {}
+		try:
+			self.__setup()
+			self.available = True
+		except:
+			self.libc = None
+
+	#  libcԤȷĻ棬շʱֻڴ濽
+	def __setup (self):
+		import ctypes, ctypes.util
+		if not sys.platform.startswith('linux'):
+			raise Exception('recvmmsg/sendmmsg need linux')
+		libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+		libc.recvmmsg, libc.sendmmsg
+		class iovec(ctypes.Structure):
+			_fields_ = [ ('iov_base', ctypes.c_void_p),
+				('iov_len', ctypes.c_size_t) ]
+		class msghdr(ctypes.Structure):
+			_fields_ = [ ('msg_name', ctypes.c_void_p),
+				('msg_namelen', ctypes.c_uint32),
+				('msg_iov', ctypes.POINTER(iovec)),
+				('msg_iovlen', ctypes.c_size_t),
+				('msg_control', ctypes.c_void_p),
+				('msg_controllen', ctypes.c_size_t),
+				('msg_flags', ctypes.c_int) ]
+		class mmsghdr(ctypes.Structure):
+			_fields_ = [ ('msg_hdr', msghdr), ('msg_len', ctypes.c_uint) ]
+		count, size = self.count, self.size
+		self.ctypes = ctypes
+		self.libc = libc
+		self.MSG_DONTWAIT = 0x40
+		self.stride = ctypes.sizeof(mmsghdr)
+		self.offset = mmsghdr.msg_len.offset
+		self.iovfmt = struct.Struct('PL')
+		self.rcv_msg = (mmsghdr * count)()
+		self.rcv_iov = (iovec * count)()
+		self.rcv_buf = ctypes.create_string_buffer(count * size)
+		self.rcv_name = ctypes.create_string_buffer(count * 16)
+		self.snd_msg = (mmsghdr * count)()
+		self.snd_iov = (iovec * count)()
+		self.snd_name = ctypes.create_string_buffer(count * 16)
+		self.snd_buf = None
+		self.rcv_base = ctypes.addressof(self.rcv_buf)
+		self.rcv_head = ctypes.addressof(self.rcv_msg)
+		for i in xrange(count):
+			self.rcv_iov[i].iov_base = self.rcv_base + i * size
+			self.rcv_iov[i].iov_len = size
+			hdr = self.rcv_msg[i].msg_hdr
+			hdr.msg_name = ctypes.addressof(self.rcv_name) + i * 16
+			hdr.msg_namelen = 16
+			hdr.msg_iov = ctypes.pointer(self.rcv_iov[i])
+			hdr.msg_iovlen = 1
+			hdr = self.snd_msg[i].msg_hdr
+			hdr.msg_name = ctypes.addressof(self.snd_name) + i * 16
+			hdr.msg_namelen = 16
+			hdr.msg_iov = ctypes.pointer(self.snd_iov[i])
+			hdr.msg_iovlen = 1
+		self.lenfmt = {}
+
+	# գ [(data, remote), ...]ûʱؿб
+	def recv (self, fd):
+		ctypes = self.ctypes
+		stride, size = self.stride, self.size
+		n = self.libc.recvmmsg(fd, self.rcv_msg, self.count, \
+			self.MSG_DONTWAIT, None)
+		if n <= 0:
+			return []
+		lenfmt = self.lenfmt.get(n)
+		if lenfmt is None:
+			tail = stride - self.offset - 4
+			lenfmt = struct.Struct(('%dxI%dx'%(self.offset, tail)) * n)
+			self.lenfmt[n] = lenfmt
+		sizes = lenfmt.unpack(ctypes.string_at(self.rcv_head, stride * n))
+		names = ctypes.string_at(self.rcv_name, 16 * n)
+		string_at = ctypes.string_at
+		base = self.rcv_base
+		addrs = self.addrs
+		result = []
+		for i in xrange(n):
+			name = names[i * 16:i * 16 + 8]
+			remote = addrs.get(name)
+			if remote is None:
+				port = struct.unpack('!H', name[2:4])[0]
+				remote = (socket.inet_ntoa(name[4:8]), port)
+				if len(addrs) > 0x10000: addrs.clear()
+				addrs[name] = remote
+			result.append((string_at(base + i * size, sizes[i]), remote))
+		return result
+
+	# ͣpacketsΪ [(data, remote, ...), ...]سɹ͵İ
+	# doneΪ Noneʱ׷ӳɹ͵ĸ packetsе±
+	def send (self, fd, packets, done = None):
+		ctypes = self.ctypes
+		total, sent = 0, 0
+		while total < len(packets):
+			count = min(self.count, len(packets) - total)
+			self.__prepare(packets[total:total + count])
+			n = self.libc.sendmmsg(fd, self.snd_msg, count, \
+				self.MSG_DONTWAIT)
+			if n <= 0:
+				if ctypes.get_errno() in (errno.EAGAIN, errno.EWOULDBLOCK):
+					break		# ͻһ
+				total += 1		# ðַǷ
+				continue
+			if done is not None:
+				done.extend(xrange(total, total + n))
+			total += n
+			sent += n
+		return sent
+
+	# һͻ棬дַ iovec
+	def __prepare (self, chunk):
+		ctypes = self.ctypes
+		names = self.names
+		namelist = []
+		iovlist = []
+		datalist = []
+		sizes = []
+		for item in chunk:
+			data, remote = item[0], item[1]
+			name = names.get(remote)
+			if name is None:
+				try: name = sockaddr(remote)
+				except: name = '\x00' * 16
+				if len(names) > 0x10000: names.clear()
+				names[remote] = name
+			namelist.append(name)
+			if type(data) is tuple:		# ֶݣֱƴ뷢ͻ
+				datalist.extend(data)
+				sizes.append(_buflen(data))
+			else:
+				datalist.append(data)
+				sizes.append(len(data))
+		blob = ''.join(datalist)
+		self.snd_buf = ctypes.create_string_buffer(blob, len(blob))
+		base = ctypes.addressof(self.snd_buf)
+		pack = self.iovfmt.pack
+		for size in sizes:
+			iovlist.append(pack(base, size))
+			base += size
+		iov = ''.join(iovlist)
+		ctypes.memmove(self.snd_name, ''.join(namelist), 16 * len(chunk))
+		ctypes.memmove(self.snd_iov, iov, len(iov))
+		return 0
+
+
 #----------------------------------------------------------------------
 # ַ
 #----------------------------------------------------------------------
@@ -115,6 +388,13 @@ EP_NORMAL		=	0		# Ĭ
 EP_INNAT		=	1		# NAT
 EP_GLOBAL		=	2		# ڹ
 
+NAT_UNKNOWN		=	0		# ûм⣨ûбö˿ڣ
+NAT_OPEN		=	1		# ַû NAT
+NAT_CONE		=	2		# ӳĿ޹أ˿ڷİҲյ
+NAT_RESTRICT	=	3		# ӳĿ޹أֻѾ͹ĵַ˿ڵİ
+NAT_SYMMETRIC	=	4		# ԲͬĿʹòͬӳ
+NAT_DELTA		=	64		# Գ nat˿ڲֵΪ
+
 
 #----------------------------------------------------------------------
 # endpoint: صַбԼnatַĵַϢ
@@ -127,6 +407,8 @@ class endpoint(object):
 		self.local = [n for n in local]
 		self.text = ''
 		self.type = EP_NORMAL
+		self.nattype = NAT_UNKNOWN
+		self.natdelta = 0				# Գ nat˿ڷĲ
 		self.split1 = '+'
 		self.split2 = '/'
 		self.analyse()
@@ -143,11 +425,17 @@ class endpoint(object):
 				break
 		return self.type
 
-	# Ϊַ endpointַΪ linkdesc
+	# Ϊַ endpointַΪ linkdescnat
+	# ˿ڲΪصַбе ":natN"":deltaN"¼ϰ汾
+	# Ϊյַ
 	def marshal (self):
 		local = []
 		for ip, port in self.local:		# ¼صַб
 			local.append('%s:%d'%(ip, port))
+		if self.nattype:
+			local.append(':nat%d'%self.nattype)
+		if self.natdelta:
+			local.append(':delta%d'%self.natdelta)
 		text = self.split1.join(local)
 		if self.nat:					# ¼natַ
 			text += self.split2 + '%s:%d'%(self.nat[0], self.nat[1])
@@ -162,10 +450,20 @@ class endpoint(object):
 		pos = text.find(self.split2)
 		self.nat = None
 		self.local = []
+		self.nattype = NAT_UNKNOWN
+		self.natdelta = 0
 		if pos >= 0:
 			self.nat = text2ep(text[pos + 1:])
 			text = text[:pos]
 		for n in text.split(self.split1):
+			if n[:4] == ':nat':
+				try: self.nattype = int(n[4:])
+				except: pass
+				continue
+			if n[:6] == ':delta':
+				try: self.natdelta = int(n[6:])
+				except: pass
+				continue
 			ep = text2ep(n)
 			if n != '' and (ep[0] != '' or ep[1] != 0):
 				self.local.append(ep)
@@ -181,6 +479,17 @@ ITMU_ECHO		= 0x6001		# 
 ITMU_MIRROR		= 0x6002		# 
 ITMU_DELIVER	= 0x6003		# תƴ
 ITMU_FORWARD	= 0x6004		# ת
+ITMU_NATTEST	= 0x6005		# ӱö˿ڷأΪ
+
+
+_relay_head = struct.Struct('<LL4xH')		# Ŀ ipĿ˿
+_relay_addr = struct.Struct('!4sLHH')		# Դ ip0Դ˿ڣ0
+_relay_mirror = struct.Struct('!2sH4s8x')	# sockaddr_in
+_relay_altport = struct.Struct('<L')		# MIRRORеıö˿
+
+_command_names = ( 'touch', 'echo', 'mirror', 'deliver', 'forward', \
+	'nattest', 'other' )
+_metrics_limit = 0x10000		# ÿ¼ٸͻ/Ŀַ
 
 
 #----------------------------------------------------------------------
@@ -198,9 +507,175 @@ class userver(object):
 		self.time = time.time()
 		self.errd = ( errno.EINPROGRESS, errno.EALREADY, errno.EWOULDBLOCK )
 		self.errs = ( 10054, 10053, 10035 )
+		self.batch = None
+		self.sndque = []
+		self.sndctl = []
+		self.rcvque = collections.deque()
+		self.buckets = {}
+		self.quota_pps = 0
+		self.quota_bps = 0
+		self.quota_burst = 1.0
+		self.quota_time = self.time
+		self.zerocopy = True
+		self.buffer = bytearray(0x10000)
+		self.view = memoryview(self.buffer)
+		self.ipcache = {}
+		self.status = None
+		self.alt = None					# ö˿ڣڿͻ˼ nat
+		self.altport = 0
+		self.metrics_window = 60
+		self.metrics_top = 10
+		self.statistic_reset()
+
+	# ͳݸλ
+	def statistic_reset (self):
+		self.statistic_packet_in = 0
+		self.statistic_packet_out = 0
+		self.statistic_data_in = 0
+		self.statistic_data_out = 0
+		self.statistic_drop_quota = 0
+		self.statistic_drop_quota_data = 0
+		self.statistic_startup = time.time()
+		self.command_packet = [ 0 ] * len(_command_names)
+		self.command_data = [ 0 ] * len(_command_names)
+		self.clients = {}				# ǰڵĿͻ
+		self.clients_old = {}			# ǰڵĿͻ
+		self.fanout = {}				# ǰڵתĿ꣺[ֽ]
+		self.fanout_old = {}
+		self.metrics_time = self.statistic_startup
+
+	# ȡͳݣclientsΪ metrics_windowڵĲͬͻ
+	# fanoutΪת metrics_topĿַַֻ
+	def statistic (self):
+		self.__slide(time.time())
+		command = {}
+		for i in xrange(len(_command_names)):
+			command[_command_names[i]] = [ self.command_packet[i], \
+				self.command_data[i] ]
+		clients = len(self.clients_old)
+		for remote in self.clients:
+			if not remote in self.clients_old:
+				clients += 1
+		fanout = {}
+		for target, record in self.fanout_old.items():
+			fanout[target] = list(record)
+		for target, record in self.fanout.items():
+			if target in fanout:
+				fanout[target][0] += record[0]
+				fanout[target][1] += record[1]
+			else:
+				fanout[target] = list(record)
+		top = heapq.nlargest(self.metrics_top, fanout.items(), \
+			key = lambda item: item[1][1])
+		return {
+			'time': self.time - self.statistic_startup,
+			'packet_in': self.statistic_packet_in,
+			'packet_out': self.statistic_packet_out,
+			'data_in': self.statistic_data_in,
+			'data_out': self.statistic_data_out,
+			'drop_quota': self.statistic_drop_quota,
+			'drop_quota_data': self.statistic_drop_quota_data,
+			'command': command,
+			'window': self.metrics_window,
+			'clients': clients,
+			'destinations': len(fanout),
+			'fanout': dict([ (ep2text(k), v) for k, v in top ]),
+		}
+
+	# ڣڷΪǰ룬ÿڶһ
+	def __slide (self, current):
+		half = self.metrics_window * 0.5
+		if current < self.metrics_time + half:
+			return 0
+		if current < self.metrics_time + half * 2:
+			self.clients_old = self.clients
+			self.fanout_old = self.fanout
+		else:
+			self.clients_old = {}
+			self.fanout_old = {}
+		self.clients = {}
+		self.fanout = {}
+		self.metrics_time = current
+		return 0
+
+	# ¼ͻˣ·ʹã
+	def __account (self, cmd, size, remote):
+		index = cmd - ITMU_TOUCH
+		if index < 0 or index > 5:
+			index = 6
+		self.command_packet[index] += 1
+		self.command_data[index] += size
+		if remote in self.clients or len(self.clients) < _metrics_limit:
+			self.clients[remote] = 1
+		return 0
+
+	# ¼תĿ
+	def __fanout (self, target, size):
+		record = self.fanout.get(target)
+		if record is not None:
+			record[0] += 1
+			record[1] += size
+		elif len(self.fanout) < _metrics_limit:
+			self.fanout[target] = [ 1, size ]
+		return 0
+
+	# ͳƽӿڣ host:portṩı HTTPͳ
+	def statistic_listen (self, port = 0, host = '127.0.0.1'):
+		if self.status:
+			self.status.close()
+		self.status = ustatus(self.statistic)
+		if self.status.open(port, host) != 0:
+			self.status = None
+			return -1
+		return self.status.port
+
+	# תÿԴַÿת ppsbpsֽڣ0Ϊ
+	# ƣburstΪͰܻ۶ֻ FORWARD/DELIVER
+	# ECHO/MIRRORƣİֱӶ
+	def quota (self, pps = 0, bps = 0, burst = 1.0):
+		self.quota_pps = pps
+		self.quota_bps = bps
+		self.quota_burst = max(burst, 0.001)
+		self.buckets = {}
+		return 0
+
+	# Ͱ飺ת True False
+	def __admit (self, remote, size):
+		current = self.time
+		pps, bps = self.quota_pps, self.quota_bps
+		bucket = self.buckets.get(remote)
+		if bucket is None:
+			burst = self.quota_burst
+			bucket = [ pps * burst, bps * burst, current ]
+			self.buckets[remote] = bucket
+		elif current > bucket[2]:			# ʱ䲹
+			burst = self.quota_burst
+			elapsed = current - bucket[2]
+			bucket[0] = min(pps * burst, bucket[0] + pps * elapsed)
+			bucket[1] = min(bps * burst, bucket[1] + bps * elapsed)
+			bucket[2] = current
+		if (pps and bucket[0] < 1) or (bps and bucket[1] < size):
+			self.statistic_drop_quota += 1
+			self.statistic_drop_quota_data += size
+			return False
+		bucket[0] -= 1
+		bucket[1] -= size
+		return True
+
+	# ͰɾʱûתԴַǵѾˣ
+	def __expire (self):
+		if self.time - self.quota_time < 30:
+			return 0
+		self.quota_time = self.time
+		limit = self.time - max(30, self.quota_burst)
+		for remote, bucket in self.buckets.items():
+			if bucket[2] < limit:
+				del self.buckets[remote]
+		return 0
 	
-	# ʼ˿ں
-	def open (self, port = 0, bufsize = -1):
+	# ʼ˿ںţbatchʱʹշÿ batch
+	# reuseportΪʱ SO_REUSEPORT̿Լͬһ˿
+	def open (self, port = 0, bufsize = -1, batch = 0, reuseport = False):
 		self.close()
 		if bufsize < 0: 
 			bufsize = 0x100000
@@ -208,6 +683,11 @@ class userver(object):
 		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, bufsize)
 		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, bufsize)
+		if reuseport:
+			try: self.sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+			except:
+				self.close()
+				return -2
 		try: self.sock.bind(('0.0.0.0', port))
 		except: 
 			self.close()
@@ -216,6 +696,11 @@ class userver(object):
 		self.port = self.sock.getsockname()[1]
 		self.time = time.time()
 		self.state = 0
+		self.statistic_reset()
+		if batch > 0:
+			self.batch = udpbatch(batch)
+			if not self.batch.available:
+				self.batch = None
 		return 0
 	
 	# ر
@@ -226,37 +711,136 @@ class userver(object):
 			self.sock = None
 		self.port = -1
 		self.state = -1
+		self.batch = None
+		self.sndque = []
+		self.sndctl = []
+		self.rcvque.clear()
+		self.buckets = {}
+		if self.status:
+			self.status.close()
+			self.status = None
+		if self.alt:
+			try: self.alt.close()
+			except: pass
+			self.alt = None
+		self.altport = 0
+
+	# 򿪱ö˿ڣĬΪ˿ڼһMIRRORķдϱö˿ڣ
+	# ͻö˿ȡ natַӳΪ NATTESTӱ
+	# ˿ڷأΪɹ 0
+	def nattest (self, port = 0):
+		if not self.sock:
+			return -1
+		if port <= 0:
+			port = self.port + 1
+		sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		try:
+			sock.bind(('0.0.0.0', port))
+		except socket.error:
+			sock.close()
+			return -2
+		sock.setblocking(0)
+		self.alt = sock
+		self.altport = sock.getsockname()[1]
+		return 0
+
+	# ӱö˿ڷأheadΪϢͷ
+	def __nattest (self, head, remote):
+		if not self.alt:
+			return -1
+		data = str(head) + sockaddr(remote)
+		try:
+			self.alt.sendto(data, remote)
+		except socket.error:
+			return -1
+		return len(data)
+
+	# ö˿ڣֻش MIRRORӱö˿ڷأ
+	def __alternate (self):
+		while True:
+			try:
+				data, remote = self.alt.recvfrom(0x10000)
+			except socket.error:
+				break
+			if len(data) < 16:
+				continue
+			cmd = struct.unpack('<L', data[:4])[0] & 0x7fffffff
+			self.__account(cmd, len(data), remote)
+			if cmd == ITMU_MIRROR:
+				self.__nattest(data[:16], remote)
+		return 0
 	
-	# ԭʼ UDP
-	def __rawsend (self, data, remote):
+	# ԭʼ UDPͣģʽȻ棬 flushͳһͣcontrolΪʱ
+	# ƶУECHO/MIRRORķأflushʱתݷ
+	def __rawsend (self, data, remote, control = False):
+		if self.batch:
+			if control:
+				self.sndctl.append((data, remote))
+			else:
+				self.sndque.append((data, remote))
+			return 0
 		try:
 			self.sock.sendto(data, remote)
+			self.statistic_packet_out += 1
+			self.statistic_data_out += len(data)
 		except socket.error,(code, strerror):
 			pass
 	
 	# ԭʼ UDP
 	def __rawrecv (self, size = 0x10000):
-		try:
-			data, remote = self.sock.recvfrom(size)
-		except socket.error,(code, strerror):
-			return '', None
+		if self.batch:
+			if len(self.rcvque) == 0:
+				self.rcvque.extend(self.batch.recv(self.sock.fileno()))
+				if len(self.rcvque) == 0:
+					return '', None
+			data, remote = self.rcvque.popleft()
+		else:
+			try:
+				data, remote = self.sock.recvfrom(size)
+			except socket.error,(code, strerror):
+				return '', None
+		self.statistic_packet_in += 1
+		self.statistic_data_in += len(data)
 		return data, remote
 	
+	# ͻݣϢȣģʽʲô
+	def flush (self):
+		if self.sndctl:
+			self.sndque = self.sndctl + self.sndque
+			self.sndctl = []
+		if self.sndque and self.sock:
+			done = []
+			sent = self.batch.send(self.sock.fileno(), self.sndque, done)
+			for i in done:
+				self.statistic_data_out += len(self.sndque[i][0])
+			self.statistic_packet_out += sent
+		self.sndque = []
+		return 0
+	
 	#  UDPϢ
 	def __process (self, data, remote):
 		head = struct.unpack('<LLLL', data[:16])
 		cmd = int(head[0] & 0x7fffffff)
+		self.__account(cmd, len(data), remote)
 		if cmd == ITMU_ECHO:			# Ϣping
-			self.__rawsend(data, remote)
+			self.__rawsend(data, remote, True)
 		elif cmd == ITMU_MIRROR:		# ȡnatַ
 			sockaddr = 	'\x02\x00' + struct.pack('!H', remote[1])
 			sockaddr += socket.inet_aton(remote[0]) 
 			sockaddr += '\x00\x00\x00\x00\x00\x00\x00\x00'
-			self.__rawsend(data[:16] + sockaddr, remote)
+			head = data[:12] + _relay_altport.pack(self.altport)
+			self.__rawsend(head + sockaddr, remote, True)
+		elif cmd == ITMU_NATTEST:		# ӱö˿ڷ
+			self.__nattest(data[:16], remote)
+		elif self.quota_pps + self.quota_bps > 0 and \
+				cmd in (ITMU_DELIVER, ITMU_FORWARD) and \
+				not self.__admit(remote, len(data)):
+			return -1					# ת
 		elif cmd == ITMU_DELIVER:		# תͰ汾
 			val_ip = socket.inet_ntoa(data[4:8])
 			val_port = struct.unpack('!H', data[12:14])[0]
 			self.__rawsend(data[16:], (val_ip, val_port))
+			self.__fanout((val_ip, val_port), len(data) - 16)
 		elif cmd == ITMU_FORWARD:		# ת߰汾Դַ
 			val_ip = socket.inet_ntoa(data[4:8])
 			val_port = struct.unpack('<H', data[12:14])[0]
@@ -264,21 +848,577 @@ class userver(object):
 			head += '\x00\x00\x00\x00'
 			head += struct.pack('!H', remote[1]) + '\x00\x00'
 			self.__rawsend(head + data[16:], (val_ip, val_port))
+			self.__fanout((val_ip, val_port), len(data))
 		return 0
+
+	# ַת棺 ipַ ipתÿַ
+	def __ipcache (self, key):
+		ipcache = self.ipcache
+		if len(ipcache) >= 0x10000:
+			ipcache.clear()
+		if type(key) == str:
+			value = socket.inet_aton(key)
+		else:
+			value = socket.inet_ntoa(struct.pack('<L', key))
+		ipcache[key] = value
+		return value
+
+	# ٴݽյԤȷĻУԭظдϢͷֱ
+	# memoryviewͣݣշģʽʹãط͵ֽ
+	def __relay (self, size, remote):
+		if size < 16:
+			return -1
+		buf, ipcache = self.buffer, self.ipcache
+		cmd, key, port = _relay_head.unpack_from(buf, 0)
+		cmd &= 0x7fffffff
+		index = cmd - ITMU_TOUCH
+		if index < 0 or index > 5:
+			index = 6
+		self.command_packet[index] += 1
+		self.command_data[index] += size
+		clients = self.clients
+		if remote in clients or len(clients) < _metrics_limit:
+			clients[remote] = 1
+		if cmd == ITMU_FORWARD or cmd == ITMU_DELIVER:
+			if self.quota_pps + self.quota_bps > 0:
+				if not self.__admit(remote, size):
+					return -1			# ת
+		if cmd == ITMU_FORWARD:			# ת߰汾Դַ
+			target = (ipcache.get(key) or self.__ipcache(key), port)
+			ip = ipcache.get(remote[0]) or self.__ipcache(remote[0])
+			_relay_addr.pack_into(buf, 4, ip, 0, remote[1], 0)
+			data = self.view[:size]
+		elif cmd == ITMU_DELIVER:		# תͰ汾
+			port = ((port & 0xff) << 8) | (port >> 8)
+			target = (ipcache.get(key) or self.__ipcache(key), port)
+			data = self.view[16:size]
+		elif cmd == ITMU_ECHO:			# Ϣping
+			target, data = remote, self.view[:size]
+		elif cmd == ITMU_MIRROR:		# ȡnatַ
+			ip = ipcache.get(remote[0]) or self.__ipcache(remote[0])
+			_relay_mirror.pack_into(buf, 16, '\x02\x00', remote[1], ip)
+			_relay_altport.pack_into(buf, 12, self.altport)
+			target, data = remote, self.view[:32]
+		elif cmd == ITMU_NATTEST:		# ӱö˿ڷ
+			return self.__nattest(buf[:16], remote)
+		else:
+			return 0
+		try:
+			self.sock.sendto(data, target)
+		except socket.error:
+			return -1
+		if index == 3 or index == 4:
+			record = self.fanout.get(target)
+			if record is not None:
+				record[0] += 1
+				record[1] += len(data)
+			elif len(self.fanout) < _metrics_limit:
+				self.fanout[target] = [ 1, len(data) ]
+		return len(data)
 	
 	# ״̬Ҫͣĵã1һ
 	def update (self):
 		self.time = time.time()
 		if not self.sock:
 			return -1
+		if self.buckets:
+			self.__expire()
+		if self.time >= self.metrics_time + self.metrics_window * 0.5:
+			self.__slide(self.time)
+		if self.status:
+			self.status.update()
+		if self.alt:
+			self.__alternate()
+		if self.zerocopy and not self.batch:
+			recvfrom_into = self.sock.recvfrom_into
+			relay = self.__relay
+			buf = self.buffer
+			p_in, p_out, d_in, d_out = 0, 0, 0, 0
+			while True:
+				try:
+					size, remote = recvfrom_into(buf)
+				except socket.error:
+					break
+				p_in += 1
+				d_in += size
+				size = relay(size, remote)
+				if size > 0:
+					p_out += 1
+					d_out += size
+			self.statistic_packet_in += p_in
+			self.statistic_packet_out += p_out
+			self.statistic_data_in += d_in
+			self.statistic_data_out += d_out
+			return 0
 		while True:
 			data, remote = self.__rawrecv()
 			if remote == None: 
 				break
 			self.__process(data, remote)
+		self.flush()
+		return 0
+
+	# ȡ׽֣ûдʱ -1
+	def fileno (self):
+		if not self.sock:
+			return -1
+		return self.sock.fileno()
+
+	# ȡҪȴ׽֣ö˿ںͳƽӿ
+	def filenos (self):
+		if not self.sock:
+			return []
+		fds = [ self.sock.fileno() ]
+		if self.alt:
+			fds.append(self.alt.fileno())
+		if self.status:
+			fds.extend(self.status.filenos())
+		return fds
+
+	# һҪ updateʱ䣺ֻͳƽӿڵĳʱû򷵻 None
+	def deadline (self):
+		if self.sndque or len(self.rcvque) > 0:
+			return self.time
+		if self.status:
+			return self.status.deadline()
+		return None
+
+	# ȴֱݻ߳ʱȻ update
+	def wait (self, timeout = None):
+		waitfor([ self ], timeout)
+		return self.update()
+
+	# ¼ѭֱر
+	def run (self):
+		while self.sock:
+			self.wait()
 		return 0
 
 
+#----------------------------------------------------------------------
+# ucluster -  stunÿ SO_REUSEPORTͬһ
+# ˿ڣں˰Դַݣ̸̵ܸͳݣ
+# ˳Ĺ
+#----------------------------------------------------------------------
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15)
+
+# ϲͳݣӣtime/windowȡֵбλӣ
+# ֵݹϲ
+def _statistic_merge(total, stat):
+	for key, value in stat.items():
+		if type(value) == dict:
+			_statistic_merge(total.setdefault(key, {}), value)
+		elif type(value) == list:
+			prev = total.get(key)
+			if prev is None:
+				total[key] = list(value)
+			else:
+				total[key] = [ x + y for x, y in zip(prev, value) ]
+		elif key in ('time', 'window'):
+			total[key] = max(total.get(key, 0), value)
+		else:
+			total[key] = total.get(key, 0) + value
+	return total
+
+def _ucluster_worker(index, conn, port, bufsize, batch, period, quota):
+	import os
+	server = userver()
+	if server.open(port, bufsize, batch, reuseport = True) != 0:
+		conn.send((index, None))
+		return -1
+	conn.send((index, 0))				# һϢ˿Ѿ
+	if quota:
+		server.quota(*quota)
+	parent = os.getppid()
+	report = server.time
+	while os.getppid() == parent:		# ˳Զ
+		server.wait(period)
+		if server.time >= report:
+			report = server.time + period
+			conn.send((index, server.statistic()))
+	server.close()
+	return 0
+
+class ucluster(object):
+
+	# ʼ
+	def __init__ (self):
+		self.state = -1
+		self.port = -1
+		self.workers = []
+		self.pipes = []				# ÿһܵ(, д)
+		self.stats = {}
+		self.config = None
+		self.restart = 0
+		self.status = None
+
+	# 򿪷workersΪ0Ϊ cpuͬ userver
+	# quotaΪ (pps, bps, burst) userver.quotaÿ̷ֱ
+	def open (self, port = 0, workers = 0, bufsize = -1, batch = 0, \
+			period = 1.0, quota = None):
+		import multiprocessing
+		self.close()
+		if workers <= 0:
+			workers = multiprocessing.cpu_count()
+		probe = userver()				# ȷ˿ںţ֧ port = 0
+		if probe.open(port, 0x1000, reuseport = True) != 0:
+			return -1
+		port = probe.port
+		self.port = port
+		self.config = (port, bufsize, batch, period, quota)
+		self.pipes = [ multiprocessing.Pipe(False) for i in xrange(workers) ]
+		self.workers = [ None ] * workers
+		self.stats = {}
+		self.restart = 0
+		for i in xrange(workers):
+			self.__start(i)
+		self.state = 0
+		hr = self.__ready(10.0)			# н̴򿪶˿Ժͷ probe
+		probe.close()
+		if hr != 0:
+			self.close()
+			return -2
+		return 0
+
+	# ȴÿ̱˿Ѿ򿪣н̴ʧܻ timeout
+	# ûбʱ -1
+	def __ready (self, timeout):
+		limit = time.time() + timeout
+		for reader, writer in self.pipes:
+			try:
+				if not reader.poll(max(0.0, limit - time.time())):
+					return -1
+				index, stat = reader.recv()
+			except (EOFError, IOError):
+				return -1
+			if stat is None:
+				return -1
+		return 0
+
+	# 
+	def __start (self, index):
+		import multiprocessing
+		args = (index, self.pipes[index][1]) + self.config
+		worker = multiprocessing.Process(target = _ucluster_worker, \
+			args = args)
+		worker.daemon = True
+		worker.start()
+		self.workers[index] = worker
+		return 0
+
+	# رշ񣺽й
+	def close (self):
+		for worker in self.workers:
+			if worker and worker.is_alive():
+				worker.terminate()
+		for worker in self.workers:
+			if worker: worker.join()
+		if self.status:
+			self.status.close()
+			self.status = None
+		for reader, writer in self.pipes:
+			reader.close()
+			writer.close()
+		self.workers = []
+		self.pipes = []
+		self.port = -1
+		self.state = -1
+		return 0
+
+	# ״̬ռͳݣ˳Ĺ
+	def update (self):
+		if self.state < 0:
+			return -1
+		for reader, writer in self.pipes:
+			try:
+				while reader.poll():
+					index, stat = reader.recv()
+					self.__collect(index, stat)
+			except (EOFError, IOError):
+				pass
+		if self.state < 0:
+			return self.state
+		if self.status:
+			self.status.update()
+		for i in xrange(len(self.workers)):
+			if not self.workers[i].is_alive():
+				self.workers[i].join()
+				self.__start(i)
+				self.restart += 1
+		return 0
+
+	# ¼̵ͳ
+	def __collect (self, index, stat):
+		if stat is None:				# ̴򿪶˿ʧ
+			self.state = -2
+		elif stat != 0:					# 0ΪĽ̴˶˿
+			self.stats[index] = stat
+		return 0
+
+	# ȴֱյ̵ͳݻ߳ʱȻ update
+	# ͳƽӿԺͬʱȴͳƽӿڵ
+	def wait (self, timeout = None):
+		if self.state < 0:
+			return -1
+		fds = [ reader.fileno() for reader, writer in self.pipes ]
+		if self.status:
+			deadline = self.status.deadline()
+			if deadline is not None:
+				delay = max(0.0, deadline - time.time())
+				if timeout is None or delay < timeout:
+					timeout = delay
+			fds.extend(self.status.filenos())
+		try: select.select(fds, [], [], timeout)
+		except select.error: pass
+		return self.update()
+
+	# ͳݣΪй֮ͣworkersΪ̵ݣ
+	# ͻ˰Դַ䵽̣ clientsֱӣdestinations
+	#  fanoutǸ֮ͣͬһĿܱת
+	def statistic (self):
+		total = { 'workers': [ None ] * len(self.workers) }
+		total['restart'] = self.restart
+		for index, stat in self.stats.items():
+			if index < len(self.workers):
+				total['workers'][index] = stat
+			_statistic_merge(total, stat)
+		return total
+
+	# ͳƽӿڣ userver.statistic_listen
+	def statistic_listen (self, port = 0, host = '127.0.0.1'):
+		if self.status:
+			self.status.close()
+		self.status = ustatus(self.statistic)
+		if self.status.open(port, host) != 0:
+			self.status = None
+			return -1
+		return self.status.port
+
+
+#----------------------------------------------------------------------
+# ustatus - ͳƽӿڣ TCP˿ϵļ HTTPκ GET
+# شıͳݣÿһ " ֵ"ͳֻʱ
+# ʽӰתܡ update
+#----------------------------------------------------------------------
+def statistic_text(stat, prefix = ''):
+	lines = []
+	keys = stat.keys()
+	keys.sort()
+	for key in keys:
+		value = stat[key]
+		name = prefix and ('%s.%s'%(prefix, key)) or str(key)
+		if value is None:
+			continue
+		if type(value) == dict:
+			lines.extend(statistic_text(value, name))
+		elif type(value) == list and value and type(value[0]) == dict:
+			items = dict([ (i, value[i]) for i in xrange(len(value)) ])
+			lines.extend(statistic_text(items, name))
+		elif type(value) in (list, tuple):
+			lines.append('%s %s'%(name, ' '.join([ str(n) for n in value ])))
+		elif type(value) == float:
+			lines.append('%s %.3f'%(name, value))
+		else:
+			lines.append('%s %s'%(name, value))
+	return lines
+
+class ustatus(object):
+
+	# ʼsourceΪͳֵĺ
+	def __init__ (self, source):
+		self.source = source
+		self.sock = None
+		self.port = -1
+		self.clients = {}
+		self.limit = 64
+		self.timeout = 5.0
+		self.retry = 0.05			# ӦûзʱԺٷ
+
+	# 򿪣Ĭַֻ
+	def open (self, port = 0, host = '127.0.0.1'):
+		self.close()
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		try:
+			sock.bind((host, port))
+			sock.listen(16)
+		except socket.error:
+			sock.close()
+			return -1
+		sock.setblocking(0)
+		self.sock = sock
+		self.port = sock.getsockname()[1]
+		return 0
+
+	# رգϿ
+	def close (self):
+		for conn in self.clients:
+			try: conn.close()
+			except: pass
+		self.clients = {}
+		if self.sock:
+			try: self.sock.close()
+			except: pass
+			self.sock = None
+		self.port = -1
+		return 0
+
+	# ɻӦͳ
+	def __reply (self):
+		try:
+			body = '\n'.join(statistic_text(self.source())) + '\n'
+			head = 'HTTP/1.0 200 OK\r\n'
+		except Exception, e:
+			body = 'error: %s\n'%e
+			head = 'HTTP/1.0 500 Internal Server Error\r\n'
+		head += 'Content-Type: text/plain\r\n'
+		head += 'Content-Length: %d\r\n'%len(body)
+		head += 'Connection: close\r\n\r\n'
+		return head + body
+
+	# ͻӦ׽ֲһ update귵 True
+	def __send (self, conn, client):
+		try:
+			sent = conn.send(client[2])
+		except socket.error, e:
+			if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+				return False
+			return True
+		client[2] = client[2][sent:]
+		return not client[2]
+
+	# £ӣյͷԺ󷵻ͳݲϿͻ
+	# Ϊ [, ʱʱ, ͵ĻӦNoneΪڽ]
+	def update (self):
+		if not self.sock:
+			return -1
+		current = time.time()
+		while len(self.clients) < self.limit:
+			try:
+				conn, remote = self.sock.accept()
+			except socket.error:
+				break
+			conn.setblocking(0)
+			self.clients[conn] = [ '', current + self.timeout, None ]
+		for conn, client in self.clients.items():
+			if client[2] is None:
+				try:
+					text = conn.recv(0x1000)
+				except socket.error:
+					text = None
+				if text:
+					client[0] += text
+				if text == '' or len(client[0]) > 0x2000:
+					pass
+				elif '\r\n\r\n' in client[0] or '\n\n' in client[0]:
+					client[2] = self.__reply()
+				elif current < client[1]:
+					continue
+			if client[2] is not None:
+				if not self.__send(conn, client) and current < client[1]:
+					continue
+			del self.clients[conn]
+			try: conn.close()
+			except: pass
+		return 0
+
+	# ȡҪȴ׽
+	def filenos (self):
+		if not self.sock:
+			return []
+		return [ self.sock.fileno() ] + [ c.fileno() for c in self.clients ]
+
+	# ӳʱʱ䣬лӦûʱΪ retryԺûʱ None
+	def deadline (self):
+		if not self.clients:
+			return None
+		deadline = min([ client[1] for client in self.clients.values() ])
+		for client in self.clients.itervalues():
+			if client[2] is not None:
+				return min(deadline, time.time() + self.retry)
+		return deadline
+
+
+#----------------------------------------------------------------------
+# udpring - ̶ĽնУԺ push FalseԶǣ
+# ɵ߾ĸÿװ [item]ͬʱŽܶк
+# ĶУevictȡһΪ [None]Ĺ
+# popĹĹʱһܶ
+#----------------------------------------------------------------------
+class udpring(object):
+
+	def __init__ (self, capacity = 4000):
+		self.capacity = max(1, capacity)
+		self.queue = collections.deque()
+		self.classes = {}			#  -> İ deque
+		self.size = 0
+		self.dead = 0				# ܶĹĸ
+
+	def __len__ (self):
+		return self.size
+
+	# ĳİ
+	def count (self, cls):
+		queue = self.classes.get(cls)
+		return queue and len(queue) or 0
+
+	# βitemһΪ
+	def push (self, item):
+		if self.size >= self.capacity:
+			return False
+		node = [ item ]
+		self.queue.append(node)
+		cls = item[-1]
+		queue = self.classes.get(cls)
+		if queue is None:
+			queue = self.classes[cls] = collections.deque()
+		queue.append(node)
+		self.size += 1
+		return True
+
+	# ȡͷյʱ򷵻 None
+	def pop (self):
+		if self.size == 0:
+			return None
+		queue = self.queue
+		while 1:
+			item = queue.popleft()[0]
+			if item is not None:
+				break
+			self.dead -= 1
+		self.classes[item[-1]].popleft()
+		self.size -= 1
+		return item
+
+	# ɾһ clsİɹ True
+	def evict (self, cls):
+		queue = self.classes.get(cls)
+		if not queue:
+			return False
+		queue.popleft()[0] = None
+		self.size -= 1
+		self.dead += 1
+		if self.dead > self.capacity:
+			self.queue = collections.deque([ n for n in self.queue if n[0] ])
+			self.dead = 0
+		return True
+
+	def clear (self):
+		self.queue = collections.deque()
+		self.classes = {}
+		self.size = 0
+		self.dead = 0
+
+
+#----------------------------------------------------------------------
+# ͳƣСֶεޣһΪ 1500ʵĴ
+#----------------------------------------------------------------------
+STAT_SIZES = ( 64, 128, 256, 512, 1024, 1500 )
+STAT_WINDOWS = ( 1, 10, 60 )
+STAT_FIELDS = ( 'packet_in', 'packet_out', 'data_in', 'data_out' )
+STAT_EWMA = 10.0				# EWMAʱ䳣룩
+
+
 #----------------------------------------------------------------------
 # udpnet - stunתܵudpշ
 # ԶstunӲԶȡnatַsend/recv
@@ -292,21 +1432,43 @@ class udpnet(object):
 		self.sock = None
 		self.port = -1
 		self.sndque = collections.deque()
-		self.rcvque = collections.deque()
+		self.rcvque = udpring(1024)
 		self.addr = []
+		self.addr_version = -1
 		self.time = time.time()
 		self.tm_active = time.time()
 		self.tm_period = 0.3
 		self.errd = ( errno.EINPROGRESS, errno.EALREADY, errno.EWOULDBLOCK )
 		self.errs = ( 10054, 10053, 10035 )
 		self.server = None
+		self.servers = []
+		self.svrinfo = {}
+		self.server_version = 0
+		self.probe_period = 5.0
+		self.probe_timeout = 15.0
+		self.tm_probe = 0
 		self.nat = None
+		self.nattype = NAT_UNKNOWN
+		self.natdelta = 0
+		self.natalt = None			# ö˿ڵַNoneΪ
+		self.natmap = None			# ӱö˿ȡõ natַ
+		self.natfilter = False		# Ƿյ˴ӱö˿ڷص NATTEST
+		self.natstage = 0			# 0δʼ 1 2ӳ 3
+		self.natsent = 0
+		self.tm_nattest = 0
 		self.pingsvr = 500
 		self.maxlen = 1024
 		self.globalip = 0
 		self.type = EP_NORMAL
 		self.ep = endpoint()
 		self.linkdesc = ''
+		self.batch = None
+		self.batchque = collections.deque()
+		self.shed = ( 'relay', 'control', 'data' )
+		self.classify = None
+		self.hiwater = 0.75
+		self.congest_hold = 0.5
+		self.congest_time = 0
 		self.statistic_reset()
 	
 	# ͳݸλ
@@ -323,11 +1485,29 @@ class udpnet(object):
 		self.statistic_packet_out_per_sec = 0
 		self.statistic_data_in_per_sec = 0
 		self.statistic_data_out_per_sec = 0
+		self.statistic_drop_full = 0
+		self.statistic_drop_malformed = 0
+		self.statistic_drop_unknown = 0
+		self.statistic_shed = { 'relay': 0, 'control': 0, 'data': 0 }
+		self.statistic_forward_packet_in = 0
+		self.statistic_forward_packet_out = 0
+		self.statistic_forward_data_in = 0
+		self.statistic_forward_data_out = 0
+		self.statistic_size_in = [ 0 ] * (len(STAT_SIZES) + 1)
+		self.statistic_size_out = [ 0 ] * (len(STAT_SIZES) + 1)
+		self.statistic_samples = collections.deque(maxlen = 64)
+		self.statistic_ewma = None
+		self.statistic_save = (0, 0, 0, 0, 0, 0, 0, 0)
+		self.statistic_pingsvr = collections.deque(maxlen = 64)
 		self.statistic_time = time.time()
 		self.statistic_startup = time.time()
 	
-	# 磺Ҫָ˿ں stunַ
-	def open (self, port = 0, server = None, maxlen = 4000, bufsize = -1):
+	# 磺Ҫָ˿ں stunַbatchʱշ
+	# serverǷַбз ECHO̽⣬ѡӳ
+	# Ӧķȡ natַתǰʧȥӦʱ
+	# Զл
+	def open (self, port = 0, server = None, maxlen = 4000, bufsize = -1, \
+			batch = 0):
 		self.close()
 		if bufsize < 0: 
 			bufsize = 0x100000
@@ -345,10 +1525,27 @@ class udpnet(object):
 		self.tm_active = self.time
 		self.tm_period = 0.3
 		self.state = 0
-		self.server = server
+		if server is None:
+			self.servers = []
+		elif type(server) == tuple:
+			self.servers = [ server ]
+		else:
+			self.servers = [ tuple(n) for n in server ]
+		self.server = self.servers and self.servers[0] or None
+		self.svrinfo = {}
+		for remote in self.servers:		# ƽ rtt룩Ӧʱ
+			self.svrinfo[remote] = [ -1, self.time ]
+		self.tm_probe = self.time
 		self.maxlen = maxlen
+		self.rcvque = udpring(maxlen)
+		self.congest_time = 0
 		self.ep = endpoint()
-		self.__refresh_addr()
+		self.__natreset()
+		if batch > 0:
+			self.batch = udpbatch(batch)
+			if not self.batch.available:
+				self.batch = None
+		self.__refresh_addr(True)
 		return 0
 
 	# ر
@@ -362,26 +1559,57 @@ class udpnet(object):
 		self.sndque.clear()
 		self.rcvque.clear()
 		self.addr = []
+		self.addr_version = -1
 		self.nat = None
+		self.__natreset()
 		self.server = None
+		self.servers = []
+		self.svrinfo = {}
 		self.globalip = 0
 		self.linkdesc = ''
 		self.pingsvr = 500
+		self.batch = None
+		self.batchque.clear()
 		self.statistic_reset()
 		return 0
 	
-	# ԭʼ UDP
-	def __rawsend (self, data, remote):
+	# ԭʼ UDPͣģʽȻ棬 flushͳһ͡data
+	# ֶε tupleģʽ udpbatchͻ棬ƴһΡ
+	# forwardΪ stunתİͳƶȷʵͳȥԺż
+	def __rawsend (self, data, remote, forward = False):
+		if self.batch:
+			self.sndque.append((data, remote, forward))
+			return 0
+		if type(data) is tuple:
+			data = ''.join(data)
 		try:
 			self.sock.sendto(data, remote)
-			self.statistic_packet_out += 1
-			self.statistic_data_out += len(data)
 		#except socket.error,(code, strerror):
 		except:
-			pass
+			return -1
+		self.__sent(len(data), forward)
+		return 0
+
+	# ͳһͳɹİ
+	def __sent (self, size, forward):
+		self.statistic_packet_out += 1
+		self.statistic_data_out += size
+		self.statistic_size_out[bisect.bisect_left(STAT_SIZES, size)] += 1
+		if forward:
+			self.statistic_forward_packet_out += 1
+			self.statistic_forward_data_out += size
 	
 	# ԭʼ UDP
 	def __rawrecv (self, size = 0x10000):
+		if self.batch:
+			if len(self.batchque) == 0:
+				self.batchque.extend(self.batch.recv(self.sock.fileno()))
+				if len(self.batchque) == 0:
+					return '', None
+			data, remote = self.batchque.popleft()
+			self.statistic_packet_in += 1
+			self.statistic_data_in += len(data)
+			return data, remote
 		try:
 			data, remote = self.sock.recvfrom(size)
 			self.statistic_packet_in += 1
@@ -391,6 +1619,20 @@ class udpnet(object):
 			return '', None
 		return data, remote
 
+	# ͻݣģʽһϵͳ÷Ͷ
+	def flush (self):
+		if len(self.sndque) == 0:
+			return 0
+		packets = list(self.sndque)
+		self.sndque.clear()
+		if not self.sock:
+			return -1
+		done = []
+		sent = self.batch.send(self.sock.fileno(), packets, done)
+		for i in done:
+			self.__sent(_buflen(packets[i][0]), packets[i][2])
+		return sent
+
 	# ʱֺstunĻỰ natӳ
 	def __active (self):
 		if self.time >= self.tm_active:
@@ -409,11 +1651,115 @@ class udpnet(object):
 			if self.server:
 				self.__rawsend(head, self.server)
 			self.__refresh_addr()
+		if self.natstage in (1, 2) and self.time >= self.tm_nattest:
+			self.__natprobe()
+		if len(self.servers) > 1 and self.time >= self.tm_probe:
+			self.tm_probe = self.time + self.probe_period
+			self.__select()
+			head = struct.pack('<HHLLL', ITMU_ECHO, 0x8000, 0, 0, 0)
+			head += struct.pack('<L', _millisec())
+			for remote in self.servers:
+				self.__rawsend(head, remote)
+		return 0
+
+	# ѡǰ probe_timeoutûӦߴû
+	# ӦķӦ߱ķӳԸͣ 70%
+	#  20ϣʱлӳ͵Ӧķ
+	def __select (self):
+		best, limit = None, self.time - self.probe_timeout
+		for remote in self.servers:
+			rtt, last = self.svrinfo[remote]
+			if rtt < 0 or last < limit:
+				continue
+			if best is None or rtt < self.svrinfo[best][0]:
+				best = remote
+		if best is None or best == self.server:
+			return 0
+		rtt, last = self.svrinfo[self.server]
+		if rtt >= 0 and last >= limit:
+			target = self.svrinfo[best][0]
+			if target >= rtt * 0.7 or rtt - target <= 20:
+				return 0
+		self.__switch(best)
+		return 1
+
+	# л·ȡ natַnatַ linkdescյ
+	# MIRROR£server_versionһ֪ͨϲ
+	def __switch (self, server):
+		self.server = server
+		self.server_version += 1
+		self.__natreset()
+		if self.svrinfo[server][0] >= 0:
+			self.pingsvr = self.svrinfo[server][0]
+		self.tm_active = self.time
+		self.tm_period = 0.3
+		return 0
+
+	# ¼ natͣ natַ仯ʱ
+	def __natreset (self):
+		self.nattype = NAT_UNKNOWN
+		self.natdelta = 0
+		self.natalt = None
+		self.natmap = None
+		self.natfilter = False
+		self.natstage = 0
+		self.natsent = 0
+		return 0
+
+	# natͼ⣺˿ڷ NATTESTӱö˿ڷأյ
+	# ˵˿޹أ֮ö˿ȡ natַ˿ȡõ
+	# ͬ˵ӳĿйأԳͣÿ෢ 4Σ 0.3
+	def __natprobe (self):
+		self.tm_nattest = self.time + 0.3
+		if self.natsent >= 4:
+			if self.natstage == 1:
+				self.natstage, self.natsent = 2, 0
+			else:
+				return self.__natdone()
+		self.natsent += 1
+		if self.natstage == 1:
+			head = struct.pack('<HHLLL', ITMU_NATTEST, 0x8000, 0, 0, 0)
+			self.__rawsend(head, self.server)
+		else:
+			head = struct.pack('<HHLLL', ITMU_MIRROR, 0x8000, 0, 0, 0)
+			self.__rawsend(head, self.natalt)
+		return 0
+
+	# ɣȷ natͲ linkdescԳʱ¼ӳ
+	# ˿ڲΪ䲽 NAT_DELTAΪ䣬Ԥ⣩
+	def __natdone (self):
+		self.natstage = 3
+		if self.globalip:
+			nattype = NAT_OPEN
+		elif self.natmap is None:
+			nattype = NAT_UNKNOWN
+		elif self.natmap != self.nat:
+			nattype = NAT_SYMMETRIC
+		elif self.natfilter:
+			nattype = NAT_CONE
+		else:
+			nattype = NAT_RESTRICT
+		delta = 0
+		if nattype == NAT_SYMMETRIC:
+			delta = self.natmap[1] - self.nat[1]
+			if abs(delta) > NAT_DELTA:
+				delta = 0
+		if nattype != self.nattype or delta != self.natdelta:
+			self.nattype = nattype
+			self.natdelta = delta
+			self.__refresh_addr(True)
 		return 0
 
-	# ˢµַʱˢ±صַб
-	def __refresh_addr (self):
-		self.addr = hostaddr()			# ȡñصַб
+	# ˢµַ鹲ĵַ棬ֻбصַб仯 forceΪ
+	# 棨natַ仯ʱ endpoint linkdesc
+	def __refresh_addr (self, force = False):
+		watch = addrwatch_shared()
+		watch.check(self.time)
+		if watch.version == self.addr_version and not force:
+			return 0
+		self.addr_version = watch.version
+		self.addr = watch.addr			# ȡñصַб
+		self.globalip = 0
 		self.ep = endpoint()			#  endpoint
 		for ip, id in self.addr:		# ñصַб
 			hostep = (ip, self.port)
@@ -422,6 +1768,8 @@ class udpnet(object):
 			self.ep.local.append(hostep)	# ӱصַ
 		if self.nat:
 			self.ep.nat = self.nat		#  natַ
+		self.ep.nattype = self.nattype
+		self.ep.natdelta = self.natdelta
 		self.ep.analyse()
 		self.type = self.ep.type
 		self.linkdesc = self.ep.marshal()	# 
@@ -434,20 +1782,51 @@ class udpnet(object):
 		data, remote = self.__rawrecv()
 		if remote == None:
 			return '', None, -1
-		if remote != self.server:
-			return data, remote, 0
+		self.statistic_size_in[bisect.bisect_left(STAT_SIZES, len(data))] += 1
+		if remote != self.server and not remote in self.svrinfo:
+			if remote != self.natalt:
+				return data, remote, 0
 		if len(data) < 16: 
+			self.statistic_drop_malformed += 1
 			return '', None, 1
 		head = struct.unpack('<LLLL', data[:16])
 		body = data[16:]
 		cmd = int(head[0] & 0x7fffffff)
+		if remote == self.natalt and remote != self.server:
+			if len(data) >= 24 and self.natstage in (1, 2):	# ö˿
+				nat = (socket.inet_ntoa(data[20:24]), \
+					struct.unpack('!H', data[18:20])[0])
+				if cmd == ITMU_NATTEST and self.natstage == 1:
+					self.natfilter = True
+					self.natstage, self.natsent = 2, 0
+					self.tm_nattest = self.time
+				elif cmd == ITMU_MIRROR and self.natstage == 2:
+					self.natmap = nat
+					self.__natdone()
+			return '', None, 1
+		if remote != self.server and cmd != ITMU_FORWARD:
+			if cmd == ITMU_ECHO and len(body) >= 4:	# ̽
+				self.__probe(remote, body)
+			return '', None, 1
 		if cmd == ITMU_MIRROR:		# ȡnatַ
 			val_ip = socket.inet_ntoa(data[20:24])
 			val_port = struct.unpack('!H', data[18:20])[0]
-			self.nat = (val_ip, val_port)
+			nat = (val_ip, val_port)
 			if self.state == 0:
 				self.state = 1
-			self.__refresh_addr()
+			if nat != self.nat:
+				if self.nat is not None:
+					self.server_version += 1
+				self.nat = nat
+				self.__natreset()
+				self.__refresh_addr(True)
+			if self.natstage == 0:		# бö˿ʱ nat
+				if head[3] > 0 and head[3] < 0x10000:
+					self.natalt = (self.server[0], head[3])
+					self.natstage, self.natsent = 1, 0
+					self.tm_nattest = self.time
+				else:
+					self.__natdone()
 			self.tm_active = self.time + 45
 			return '', None, 1
 		elif cmd == ITMU_ECHO:		# صstunpingֵ
@@ -455,13 +1834,19 @@ class udpnet(object):
 			current = _millisec()
 			if current > oldtime: 
 				self.pingsvr = current - oldtime
+				self.statistic_pingsvr.append(self.pingsvr)
+			if len(self.servers) > 1:
+				self.__probe(remote, body)
 			self.tm_active = self.time + 45
 			return '', None, 1
 		elif cmd == ITMU_FORWARD:	# stunתϢ
+			self.statistic_forward_packet_in += 1
+			self.statistic_forward_data_in += len(data)
 			val_ip = socket.inet_ntoa(data[4:8])
 			val_port = struct.unpack('!H', data[12:14])[0]
 			remote = (val_ip, val_port)
 			return body, remote, 1
+		self.statistic_drop_unknown += 1
 		return '', None, 1
 
 	# ͳ״̬
@@ -482,7 +1867,93 @@ class udpnet(object):
 		self.statistic_packet_out_per_sec = p_out / delta
 		self.statistic_data_in_per_sec = d_in / delta
 		self.statistic_data_out_per_sec = d_out / delta
+		forward = ( self.statistic_forward_packet_in, \
+			self.statistic_forward_packet_out, \
+			self.statistic_forward_data_in, self.statistic_forward_data_out )
+		total = ( self.statistic_packet_in, self.statistic_packet_out, \
+			self.statistic_data_in, self.statistic_data_out )
+		counter = tuple([ t - f for t, f in zip(total, forward) ]) + forward
+		sample = [ x - y for x, y in zip(counter, self.statistic_save) ]
+		self.statistic_save = counter
+		self.statistic_samples.append((delta, sample))
+		if self.statistic_ewma is None:
+			self.statistic_ewma = [ float(n) / delta for n in sample ]
+		else:
+			alpha = 1.0 - math.exp(-delta / STAT_EWMA)
+			self.statistic_ewma = [ e + alpha * (float(n) / delta - e) \
+				for e, n in zip(self.statistic_ewma, sample) ]
+		return 0
+
+	# ¼ ECHOӦƽ rttǰûӦʱ
+	# ѡ
+	def __probe (self, remote, body):
+		oldtime = struct.unpack('<L', body[:4])[0]
+		rtt = max(0, (_millisec() - oldtime) & 0xffffffff)
+		if rtt > 60000:
+			return -1
+		info = self.svrinfo[remote]
+		if info[0] < 0:
+			info[0] = rtt
+		else:
+			info[0] = (7 * info[0] + rtt) / 8
+		info[1] = self.time
+		if self.svrinfo[self.server][0] < 0:
+			self.__select()
 		return 0
+
+	#  8directforwardתΪֵ
+	def __statistic_split (self, values):
+		direct, forward = {}, {}
+		for i in xrange(len(STAT_FIELDS)):
+			direct[STAT_FIELDS[i]] = values[i]
+			forward[STAT_FIELDS[i]] = values[i + 4]
+		return { 'direct': direct, 'forward': forward }
+
+	# ȡýṹͳݣrateΪ 1/10/60봰ڼ EWMAÿʣ
+	# Ϊֱdirectıͷתforward
+	# sizeΪշĴСֲpingsvrΪ 64η pingİٷλ
+	# ֻڵʱ㣨 64һϵÿ
+	def statistic (self):
+		rate = {}
+		for window in STAT_WINDOWS:
+			duration, total = 0.0, [ 0 ] * 8
+			for delta, sample in reversed(self.statistic_samples):
+				if duration >= window:
+					break
+				duration += delta
+				total = [ x + y for x, y in zip(total, sample) ]
+			if duration > 0:
+				total = [ n / duration for n in total ]
+			rate['%ds'%window] = self.__statistic_split(total)
+		rate['ewma'] = self.__statistic_split(self.statistic_ewma or [0] * 8)
+		pings = list(self.statistic_pingsvr)
+		pings.sort()
+		pingsvr = { 'last': self.pingsvr, 'count': len(pings) }
+		for name, p in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+			if pings:
+				pingsvr[name] = pings[min(len(pings) - 1, int(p * len(pings)))]
+			else:
+				pingsvr[name] = -1
+		return {
+			'time': self.time - self.statistic_startup,
+			'packet_in': self.statistic_packet_in,
+			'packet_out': self.statistic_packet_out,
+			'data_in': self.statistic_data_in,
+			'data_out': self.statistic_data_out,
+			'drop': {
+				'full': self.statistic_drop_full,
+				'malformed': self.statistic_drop_malformed,
+				'unknown': self.statistic_drop_unknown,
+				'shed': dict(self.statistic_shed),
+			},
+			'rate': rate,
+			'size': {
+				'bounds': list(STAT_SIZES),
+				'in': list(self.statistic_size_in),
+				'out': list(self.statistic_size_out),
+			},
+			'pingsvr': pingsvr,
+		}
 	
 	# ͳı
 	def statistic_report (self):
@@ -492,6 +1963,9 @@ class udpnet(object):
 		text += 'packet_out=%d '%self.statistic_packet_out
 		text += 'data_in=%d '%self.statistic_data_in
 		text += 'data_out=%d '%self.statistic_data_out
+		text += 'drop_full=%d '%self.statistic_drop_full
+		text += 'drop_malformed=%d '%self.statistic_drop_malformed
+		text += 'drop_unknown=%d '%self.statistic_drop_unknown
 		return text
 
 	# ״̬Ҫͣã1һ
@@ -500,33 +1974,148 @@ class udpnet(object):
 		if not self.sock:
 			return -1
 		self.__active()
+		rcvque = self.rcvque
+		classify = self.classify
+		peak = 0
 		while 1:
 			data, remote, mode = self.__try_recv()
 			if remote != None:
-				if len(self.rcvque) < self.maxlen:
-					self.rcvque.append((data, remote, mode))
+				if mode:
+					cls = 'relay'
+				elif classify:
+					cls = classify(data)
+				else:
+					cls = 'data'
+				if not rcvque.push((data, remote, mode, cls)):
+					self.__overflow((data, remote, mode, cls))
+				peak = len(rcvque)
 			elif mode == -1:
 				break
+		if peak >= rcvque.capacity * self.hiwater:
+			self.congest_time = self.time + self.congest_hold
+		self.flush()
 		self.statistic_update()
 		return self.state
+
+	# ն shed˳򣬶°ȶһ
+	# ûʱ° shedе𲻻ᱻ
+	def __overflow (self, item):
+		cls = item[-1]
+		self.statistic_drop_full += 1
+		for name in self.shed:
+			if name == cls:
+				break
+			if self.rcvque.evict(name):
+				self.statistic_shed[name] = self.statistic_shed.get(name, 0) + 1
+				self.rcvque.push(item)
+				return 0
+		self.statistic_shed[cls] = self.statistic_shed.get(cls, 0) + 1
+		return -1
+
+	# ϲ㶪һcauseΪ 'malformed' 'unknown'
+	def discard (self, cause):
+		if cause == 'malformed':
+			self.statistic_drop_malformed += 1
+		else:
+			self.statistic_drop_unknown += 1
+		return 0
+
+	# ӵһ updateнնг˸ˮλhiwater
+	#  congest_holdڷ TrueϲӦüٻԷӦ
+	def congested (self):
+		return self.time < self.congest_time
+
+	# ȡ׽֣ûдʱ -1
+	def fileno (self):
+		if not self.sock:
+			return -1
+		return self.sock.fileno()
+
+	# һҪ updateʱ䣺ʱ䣬дʱΪǰʱ
+	def deadline (self):
+		if not self.sock:
+			return None
+		if len(self.sndque) > 0 or len(self.batchque) > 0:
+			return self.time
+		deadline = self.tm_active
+		if len(self.servers) > 1:
+			deadline = min(deadline, self.tm_probe)
+		if self.natstage in (1, 2):
+			deadline = min(deadline, self.tm_nattest)
+		if self.congest_time > self.time:		# ӵʱָ
+			return min(deadline, self.congest_time)
+		return deadline
+
+	# ȴֱݻ߱ʱȻ update
+	def wait (self, timeout = None):
+		waitfor([ self ], timeout)
+		return self.update()
+
+	# ¼ѭֱ׽ֹر
+	def run (self):
+		while self.sock:
+			self.wait()
+		return 0
 	
 	# ݣdata:  remote:Զ̵ַ  forward:Ƿstunת
+	# data (Эͷ, Ϣ)ķֶ tupleʡȥߵƴ
 	def send (self, data, remote, forward = 0):
 		if not forward:
 			self.__rawsend(data, remote)
 		elif self.server:
-			head = struct.pack('<HH', ITMU_FORWARD, 0x8000)
-			val_ip = struct.unpack('<L', socket.inet_aton(remote[0]))[0]
-			val_port = remote[1]
-			head += struct.pack('<LLL', val_ip, 0, val_port)
-			self.__rawsend(head + data, self.server)
+			head = _forward_struct.pack(ITMU_FORWARD, 0x8000, \
+				socket.inet_aton(remote[0]), 0, remote[1])
+			if type(data) is tuple:
+				data = (head,) + data
+			else:
+				data = (head, data)
+			self.__rawsend(data, self.server, True)
 
 	# ݣdata:  remote:Զ̵ַ  forward:Ƿstunת
 	def recv (self):
-		if len(self.rcvque) == 0:
+		item = self.rcvque.pop()
+		if item is None:
 			return '', None, -1
-		data, remote, mode = self.rcvque.popleft()
-		return data, remote, mode
+		return item[0], item[1], item[2]
+
+
+#----------------------------------------------------------------------
+# waitfor - ¼ȴobjectsΪ udpnet/userver/hostnet/easenet
+# fileno() deadline()Ķ filenos()ʱȴص
+# ׽֣һ׽ֿɶ deadlineڣ
+# timeoutʱؿɶ׽
+#----------------------------------------------------------------------
+def waitfor(objects, timeout = None):
+	current = time.time()
+	fds = []
+	limit = -1
+	if timeout is not None:
+		limit = current + max(0.0, timeout)
+	for obj in objects:
+		if hasattr(obj, 'filenos'):
+			fds.extend(obj.filenos())
+		else:
+			fd = obj.fileno()
+			if fd >= 0:
+				fds.append(fd)
+		deadline = obj.deadline()
+		if deadline is not None:
+			if limit < 0 or deadline < limit:
+				limit = deadline
+	delay = None
+	if limit >= 0:
+		delay = limit - current
+		if delay <= 0:
+			return 0
+	if not fds:
+		if delay is not None:
+			time.sleep(delay)
+		return 0
+	try:
+		readable = select.select(fds, [], [], delay)[0]
+	except select.error:
+		return 0
+	return len(readable)
 
 
 #----------------------------------------------------------------------
@@ -589,6 +2178,77 @@ class timeout(object):
 		return current - self.startup
 
 
+#----------------------------------------------------------------------
+# timerheap - ʱѣ keyǼһҪ updateʱ䣬expire
+# ֻصڵ keyÿθµĿֻ͵ڵĶйأǺ
+# йءȡǰĶʱڶ¹ڵļ¼ʱ
+#----------------------------------------------------------------------
+class timerheap(object):
+
+	def __init__ (self):
+		self.heap = []
+		self.timers = {}			# key -> (deadline, )
+		self.serial = 0
+
+	def __len__ (self):
+		return len(self.timers)
+
+	def __contains__ (self, key):
+		return key in self.timers
+
+	# Ǽǣ֤ key deadline֮ǰڣѾиĶʱ򲻱
+	def schedule (self, key, deadline):
+		timer = self.timers.get(key)
+		if timer is not None and timer[0] <= deadline:
+			return 0
+		self.serial += 1
+		self.timers[key] = (deadline, self.serial)
+		heapq.heappush(self.heap, (deadline, self.serial, key))
+		if len(self.heap) > len(self.timers) * 2 + 64:
+			self.__compact()
+		return 0
+
+	# ȡ
+	def cancel (self, key):
+		if key in self.timers:
+			del self.timers[key]
+		return 0
+
+	# 
+	def clear (self):
+		self.heap = []
+		self.timers = {}
+		return 0
+
+	# ȥйڵļ¼
+	def __compact (self):
+		self.heap = [ (t[0], t[1], k) for k, t in self.timers.iteritems() ]
+		heapq.heapify(self.heap)
+		return 0
+
+	# ȡеڵ keyͬʱȡǵĶʱʱ
+	def expire (self, current):
+		heap, timers = self.heap, self.timers
+		fired = []
+		while heap and heap[0][0] <= current:
+			deadline, serial, key = heapq.heappop(heap)
+			timer = timers.get(key)
+			if timer is not None and timer[1] == serial:
+				del timers[key]
+				fired.append(key)
+		return fired
+
+	# ĵʱ䣬ûжʱʱ None
+	def deadline (self):
+		heap, timers = self.heap, self.timers
+		while heap:
+			timer = timers.get(heap[0][2])
+			if timer is not None and timer[1] == heap[0][1]:
+				return heap[0][0]
+			heapq.heappop(heap)
+		return None
+
+
 #----------------------------------------------------------------------
 # ӷ: ȽϿӵĵַ
 #----------------------------------------------------------------------
@@ -778,6 +2438,83 @@ if __name__ == '__main__':
 				tm1.reset()
 				startup = time.time()
 				print 'reset\n'
+
+	# ܲԣշշrecvmmsg/sendmmsgԱ
+	def test6(count = 200000, burst = 64):
+		def bench(batch):
+			udpsvr = userver()
+			udpsvr.open(0, batch = batch)
+			host = udpnet()
+			host.open(0, ('127.0.0.1', udpsvr.port), batch = batch)
+			data = struct.pack('<HHLLL', ITMU_ECHO, 0x8000, 0, 0, 0)
+			data += struct.pack('<L', 0) + 'x' * 100
+			server = ('127.0.0.1', udpsvr.port)
+			sent, last = 0, 0
+			ts = time.time()
+			idle = ts
+			while host.statistic_packet_in < count:
+				if sent < count and sent - host.statistic_packet_in < 1024:
+					for i in xrange(burst):
+						host.send(data, server)
+					sent += burst
+				host.flush()
+				udpsvr.update()
+				host.update()
+				if host.statistic_packet_in != last:
+					last = host.statistic_packet_in
+					idle = time.time()
+				elif time.time() - idle > 0.5:	# ˣٵȴ
+					break
+			ts = idle - ts
+			pps = host.statistic_packet_in / ts
+			mode = batch and (udpsvr.batch and 'batch' or 'fallback') or 'single'
+			print '%-8s packets=%d time=%.3f pps=%d'%(mode, \
+				host.statistic_packet_in, ts, pps)
+			host.close()
+			udpsvr.close()
+		bench(0)
+		bench(burst)
+
+	# ܲԣuserverתITMU_FORWARDԭеַƴ
+	# ʽ recvfrom_into/memoryviewԭظдʽԱȣֻͳƷ
+	# updateõʱ
+	def test7(count = 200000, burst = 64, size = 1000):
+		def bench(zerocopy):
+			udpsvr = userver()
+			udpsvr.open(0)
+			udpsvr.zerocopy = zerocopy
+			server = ('127.0.0.1', udpsvr.port)
+			host1, host2 = udpnet(), udpnet()
+			host1.open(0, server)
+			host2.open(0, server)
+			remote = ('127.0.0.1', host2.port)
+			data = 'x' * size
+			sent, last, cost = 0, 0, 0.0
+			idle = time.time()
+			while host2.statistic_packet_in < count:
+				if sent < count and sent - host2.statistic_packet_in < 1024:
+					for i in xrange(burst):
+						host1.send(data, remote, 1)
+					sent += burst
+				ts = time.time()
+				udpsvr.update()
+				cost += time.time() - ts
+				host2.update()
+				while host2.recv()[2] >= 0: pass
+				if host2.statistic_packet_in != last:
+					last = host2.statistic_packet_in
+					idle = time.time()
+				elif time.time() - idle > 0.5:	# ˣٵȴ
+					break
+			pps = udpsvr.statistic_packet_out / cost
+			mode = zerocopy and 'zerocopy' or 'copy'
+			print '%-8s relayed=%d server_time=%.3f pps=%d'%(mode, \
+				udpsvr.statistic_packet_out, cost, pps)
+			host1.close()
+			host2.close()
+			udpsvr.close()
+		bench(False)
+		bench(True)
 	test3()
 
 
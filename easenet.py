@@ -140,8 +140,8 @@ class easenet(object):
 		self.peerlist = {}
 		self.timeslap = self.current
 	
-	def init (self, uid, passwd, port, server):
-		self.host.init(uid, passwd, port, server)
+	def init (self, uid, passwd, port, server, batch = 0):
+		self.host.init(uid, passwd, port, server, batch)
 		self.uid = self.host.uid
 		self.key = self.host.key
 		self.accepted = {}
@@ -279,6 +279,28 @@ class easenet(object):
 			self.timeslap = self.current + 0.2
 		return 0
 
+	def fileno (self):
+		return self.host.fileno()
+
+	# һҪ updateʱ䣺жԶ˻ߵȴܵʱҪɨ
+	def deadline (self):
+		deadline = self.host.deadline()
+		if self.peerlist or self.accepted or self.host.accepted:
+			if deadline is None or self.timeslap < deadline:
+				deadline = self.timeslap
+		return deadline
+
+	# ȴֱյݻ߶ʱڣȻ update
+	def wait (self, timeout = None):
+		cnetudp.waitfor([ self ], timeout)
+		return self.update()
+
+	# ¼ѭֱر
+	def run (self):
+		while self.host.network.sock:
+			self.wait()
+		return 0
+
 
 
 #----------------------------------------------------------------------
@@ -321,7 +343,7 @@ if __name__ == '__main__':
 		timeslap = time.time()
 		seq = 0
 		while 1:
-			time.sleep(0.01)
+			cnetudp.waitfor([ host1, host2 ], timeslap - time.time())
 			host1.update()
 			host2.update()
 			t1 = host1.status(ident1[0], ident1[1])
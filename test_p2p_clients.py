@@ -1,5 +1,6 @@
 import sys, time
 import easenet
+import cnetudp
 
 # stun server (punching server) address
 STUN_ADDRESS = ('127.0.0.1', 9000)
@@ -35,7 +36,7 @@ def test_p2p_client(uid1, key1, uid2, key2, STUN_SERVER):
 	timeslap = time.time()
 	seq = 0
 	while 1:
-		time.sleep(0.01)
+		cnetudp.waitfor([ host1, host2 ], timeslap - time.time())
 		host1.update()
 		host2.update()
 		t1 = host1.status(ident1[0], ident1[1])
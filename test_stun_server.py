@@ -2,14 +2,62 @@ import sys, time
 import cnetudp
 
 
-def running():
-	stun = cnetudp.userver()
-	stun.open(9000)
-	print 'stun server startup (listening from port 9000) ....'
-	while 1:	
-		stun.update()
-		time.sleep(0.002)
+def running(port = 9000, workers = 0, quota = None, status = 0, natport = -1):
+	if workers <= 0:
+		stun = cnetudp.userver()
+		stun.open(port)
+		if quota:
+			stun.quota(*quota)
+		if natport >= 0 and stun.nattest(natport) != 0:
+			print 'can not listen nat test port'
+		if status > 0 and stun.statistic_listen(status) < 0:
+			print 'can not listen status on port %d'%status
+		print 'stun server startup (listening from port %d) ....'%port
+		stun.run()
+		return 0
+	cluster = cnetudp.ucluster()
+	if cluster.open(port, workers, quota = quota) != 0:
+		print 'can not listen on port %d with SO_REUSEPORT'%port
+		return -1
+	if status > 0 and cluster.statistic_listen(status) < 0:
+		print 'can not listen status on port %d'%status
+	print 'stun server startup (listening from port %d, %d workers) ....'%(\
+		port, workers)
+	report = time.time() + 10
+	while 1:
+		if cluster.wait(1.0) < 0:
+			print 'worker failed to open port %d'%port
+			break
+		if time.time() >= report:
+			report = time.time() + 10
+			stat = cluster.statistic()
+			print 'packet_in=%d packet_out=%d data_in=%d data_out=%d '\
+				'drop_quota=%d clients=%d restart=%d'%(\
+				stat.get('packet_in', 0), stat.get('packet_out', 0), \
+				stat.get('data_in', 0), stat.get('data_out', 0), \
+				stat.get('drop_quota', 0), stat.get('clients', 0), \
+				stat['restart'])
+	cluster.close()
+	return -1
 
 
 if __name__ == '__main__':
-	running()
+	import optparse
+	parser = optparse.OptionParser()
+	parser.add_option('--port', type = 'int', default = 9000)
+	parser.add_option('--workers', type = 'int', default = 0, \
+		help = 'worker processes sharing the port, 0 for single process')
+	parser.add_option('--relay-pps', type = 'int', default = 0, \
+		help = 'relay packets per second per client, 0 for unlimited')
+	parser.add_option('--relay-bps', type = 'int', default = 0, \
+		help = 'relay bytes per second per client, 0 for unlimited')
+	parser.add_option('--status', type = 'int', default = 0, \
+		help = 'plain text http statistic port on 127.0.0.1, 0 to disable')
+	parser.add_option('--nat-port', type = 'int', default = -1, \
+		help = 'alternate port for client nat type detection, 0 for port+1, '
+		'single process only')
+	opts, args = parser.parse_args()
+	quota = None
+	if opts.relay_pps or opts.relay_bps:
+		quota = (opts.relay_pps, opts.relay_bps)
+	running(opts.port, opts.workers, quota, opts.status, opts.nat_port)